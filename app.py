@@ -2,32 +2,49 @@ from fasthtml.common import *
 from fasthtml.xtend import picolink
 from fasthtml.oauth import GoogleAppClient
 import asyncio
-from collections import deque
+import collections
 from dataclasses import dataclass, field
-import concurrent.futures
+import itertools
 import logging
-import threading
-from typing import List, Tuple
+import math
+import time
+from typing import List
 from auth import HuggingFaceClient
-from difflib import SequenceMatcher
-from js_scripts import ThemeSwitch, enterToBid
+from broadcast import Broadcaster, render
+from topic_queue import TopicQueue
+from pregen import QuestionPregenerator
+from topic_cache import TopicCache
+from similarity import TopicIndex
+from trivia_sampler import TriviaSampler
+from db_pool import AsyncDB
+from ledger import PointsLedger
+from leaderboard import Leaderboard
+from round_answers import RoundAnswers
+from presence import Presence
+from broker import LocalBroker, SQLiteBroker
+from executor_pool import ExecutorPool
+from pipeline_trace import PipelineTrace, mark
+from loop_monitor import LoopMonitor
+import metrics
+from moderation import Moderator, load_blocklist
+from js_scripts import ThemeSwitch, enterToBid, clientCountdown
 import llm_req
 import copy
 import env_vars
-import sqlite3
-from datasets import load_dataset
+import trivia_import
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=env_vars.LOG_LEVEL)
 
 SIGN_IN_TEXT = """Only logged users can play. Press on either "Sign in with HuggingFace" or "Sign in with Google"."""
+LEADERBOARD_SIZE = 20
 
 db_path = f'{env_vars.DB_DIRECTORY}trivia.db'
 db = database(db_path)
+adb = AsyncDB(db_path, env_vars.DB_POOL_SIZE)  # Use this one from request handlers and tasks, it doesn't block the event loop
 players = db.t.players
 trivias = db.t.trivias
+loop_monitor = LoopMonitor(env_vars.LOOP_LAG_PROBE_SEC, env_vars.SLOW_CALLBACK_SEC)
     
-def similar(a, b):
-    return SequenceMatcher(None, a, b).ratio()
 
 
 css = [
@@ -75,16 +92,36 @@ class Question:
     correct_answer: str
 
 
+def question_from_llm(content):
+    return Question(content["trivia question"],
+                    content["option A"],
+                    content["option B"],
+                    content["option C"],
+                    content["option D"],
+                    content["correct answer"].replace(" ", "_"))
+
+
 @dataclass(order=True)
 class Topic:
     points: int
     topic: str = field(compare=False)
     status: str = field(default="pending", compare=False)
     user: str = field(default="[bot]", compare=False)
-    answers: List[Tuple[str, str]] = field(default_factory=list, compare=False)
+    answers: RoundAnswers = field(default_factory=RoundAnswers, compare=False)
     winners: List[str] = field(default_factory=list, compare=False)
     question: Question = field(default=None, compare=False)
     is_from_db: bool = field(default=False, compare=False)
+    handle: list = field(default=None, compare=False, repr=False)
+    index_key: int = field(default=None, compare=False, repr=False)
+    option_fragments: dict = field(default=None, compare=False, repr=False)
+    round_id: int = field(default=None, compare=False, repr=False)  # Set when the question is played, sent back with the answers
+    progress: float = field(default=None, compare=False, repr=False)  # Share of the question generated so far
+    timestamps: dict = field(default_factory=dict, compare=False, repr=False)  # Pipeline event -> monotonic time
+    speculation: asyncio.Task = field(default=None, compare=False, repr=False)  # Question generation started during moderation
+    @property
+    def source(self):
+        return "db" if self.is_from_db else "bot" if self.user == "[bot]" else "user"
+
     def __hash__(self):
         return hash((self.points, self.topic, self.user))
 
@@ -95,70 +132,168 @@ class Topic:
 
 
 class TaskManager:
-    def __init__(self, num_executors: int):
-        self.topics = deque()
+    def __init__(self, broker):
         self.topics_lock = asyncio.Lock()
-        self.answers_lock = asyncio.Lock()
+        self.presence = Presence()  # Track connected WebSocket clients
+        self.broadcaster = Broadcaster(env_vars.WS_SEND_QUEUE_SIZE, self.remove_client)
+        self.broker = broker
+        self.commands = {"bid": self.bid, "answer": self.answer, "register_player": self.register_player}  # Run by the broker on the leading worker
+        self.game_tasks = []
+        self.topic_cache = TopicCache(adb, env_vars.TOPIC_CACHE_TTL_SEC, env_vars.TOPIC_CACHE_MAX_TOPICS, env_vars.TOPIC_CACHE_QUESTIONS_PER_TOPIC)
+        self.pipeline_trace = PipelineTrace()
+        self.moderator = Moderator(self.topic_cache, env_vars.TOPIC_MAX_LENGTH, load_blocklist(env_vars.MODERATION_BLOCKLIST_PATH))
+        self.reset_game()
+        metrics.gauge("trivia_ws_sockets", lambda: len(self.presence))
+        metrics.gauge("trivia_ws_users", lambda: len(self.presence.users()))
+        metrics.gauge("trivia_topics", lambda: [({"status": status}, count) for status, count in collections.Counter(topic.status for topic in self.topics).items()])
+        metrics.gauge("trivia_queue_depth", lambda: [({"queue": "moderation"}, self.moderation_queue.qsize()), ({"queue": "generation"}, self.work_queue.qsize())])
+        metrics.gauge("trivia_executors", lambda: len(self.executor_pool.workers))
+
+    def reset_game(self):
+        "Round clock and topic pipeline state, only used by the worker leading the game"
+        self.topics = TopicQueue()
         self.past_topic = None
-        self.executors = [concurrent.futures.ThreadPoolExecutor(max_workers=1) for _ in range(num_executors)]
-        self.executor_tasks = [set() for _ in range(num_executors)]
+        self.moderation_queue = asyncio.PriorityQueue()  # User topics waiting for moderation, highest bid first
+        self.work_queue = asyncio.PriorityQueue()  # Topics waiting for their next pipeline stage, highest bid first
+        self.work_seq = itertools.count()
+        #generation executors, as many as the backlog needs and the generator slots can serve
+        self.executor_pool = ExecutorPool(self.work_queue, self.execute, env_vars.MIN_EXECUTORS, env_vars.MAX_EXECUTORS,
+                                          lambda: llm_req.gen_q_pool.available_slots)
         self.current_topic_start_time = None
         self.current_timeout_task = None
-        self.online_users = {"unassigned_clients": {'ws_clients': set(), 'combo_count': 0 }}  # Track connected WebSocket clients
-        self.online_users_lock = threading.Lock()
         self.task = None
         self.countdown_var = env_vars.QUESTION_COUNTDOWN_SEC
+        self.round_deadline = None
         self.current_topic = None
         self.all_users = {}
+        self.round_nr = 0
+        self.round_ids = itertools.count(int(time.time() * 1000))  # starts past the ids of a previous leader
+        self.win_streaks = {}  # user -> (last round won, consecutive wins)
+        self.leaderboard = Leaderboard(LEADERBOARD_SIZE)
+        self.ledger = PointsLedger(adb, self.leaderboard.update)
+        self.topic_index = TopicIndex(env_vars.DUPLICATE_TOPIC_THRESHOLD)  # Active, current and recently played topics
+        self.trivia_sampler = TriviaSampler(adb)
+        self.pregenerator = QuestionPregenerator(env_vars.PREGEN_BUFFER_SIZE, random_db_topic, self.wait_idle)
+
+    async def start_game(self):
+        results = await adb.fetchall("SELECT id, name, points FROM players")
+        self.all_users = {row['name']: row['id'] for row in results}
+        self.leaderboard.load(results)
+        await self.trivia_sampler.create_tables()
+        self.game_tasks = [asyncio.create_task(self.executor_pool.run())]
+        #one moderator per checker slot, so a burst of bids fills every slot without holding up the executors
+        self.game_tasks += [asyncio.create_task(self.run_moderator(i)) for i in range(llm_req.topic_check_pool.total_slots)]
+        self.game_tasks.append(asyncio.create_task(self.ledger.run(env_vars.LEDGER_FLUSH_SEC)))
+        self.game_tasks.append(asyncio.create_task(start_topic_pipeline(self)))
+
+    async def stop_game(self):
+        speculations = [topic.speculation for topic in self.topics if topic.speculation]
+        tasks = [task for task in [*self.game_tasks, *speculations, self.task, self.current_timeout_task] if task]
+        for task in tasks:
+            task.cancel()
+        self.game_tasks = []
+        #let them unwind, so none of them still uses the database once the caller closes it
+        await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            await self.ledger.flush()
+        except Exception as e:
+            logging.error(f"Points flush failed while stopping the game: {e}")
+        self.reset_game()
 
     def reset(self):
         self.countdown_var = env_vars.QUESTION_COUNTDOWN_SEC
 
-    async def run_executor(self, executor_id: int):
+    async def execute(self, work_item):
+        _, _, topic = work_item
+        await self.update_status(topic)
+
+    async def run_moderator(self, moderator_id: int):
         while True:
-            topic_to_process = None
-            async with self.topics_lock:
-                for topic in self.topics:
-                    if all(topic not in tasks for tasks in self.executor_tasks):
-                        if topic.status not in ["successful", "failed"]:
-                            self.executor_tasks[executor_id].add(topic)
-                            topic_to_process = topic
-                            break
-
-            if topic_to_process:
-                await self.update_status(topic_to_process)
-                async with self.topics_lock:
-                    self.executor_tasks[executor_id].remove(topic_to_process)
-            await asyncio.sleep(0.1)
+            _, _, topic = await self.moderation_queue.get()
+            try:
+                await self.moderate(topic)
+            except Exception as e:
+                logging.debug(f"Moderator {moderator_id} failed on topic {topic.topic}: {e}")
+            finally:
+                self.moderation_queue.task_done()
+
+    async def moderate(self, topic: Topic):
+        speculation = None
+        if 0 < env_vars.SPECULATIVE_GEN_MIN_POINTS <= topic.points and self.moderator.prefilter(topic.topic) is None:
+            #generate the question while the topic is being moderated, it's thrown away if the topic is rejected
+            speculation = asyncio.create_task(self.fetch_question(topic))
+            #a rejected topic's speculation is never awaited, its error is retrieved here instead of logged at exit
+            speculation.add_done_callback(lambda task: task.cancelled() or task.exception())
+        mark(topic.timestamps, "moderation_start")
+        try:
+            verdict = await self.moderator.check(topic.topic)
+        except Exception as e:
+            #like a failed LLM check: the topic fails and is removed instead of staying pending
+            logging.debug(f"Moderation failed for topic {topic.topic}: {e}")
+            verdict = None
+        except BaseException:
+            if speculation:
+                speculation.cancel()
+            raise
+        mark(topic.timestamps, "moderation_end")
+        async with self.topics_lock:
+            topic.status = "computing" if verdict == "No" else "failed"
+        if topic.status == "computing":
+            #an executor waits for the speculative generation, so this moderator moves on to the next bid
+            topic.speculation = speculation
+            self.dispatch(topic)
+        else:
+            if speculation:
+                speculation.cancel()
+            asyncio.create_task(self.remove_failed_topic(topic))
+        await self.broadcast_next_topics()
+
+    def dispatch(self, topic: Topic):
+        #only user bids are moderated, dataset and pre-generated topics already have their question
+        if topic.status == "pending" and not (topic.is_from_db or topic.question):
+            self.moderation_queue.put_nowait((-topic.points, next(self.work_seq), topic))
+        else:
+            self.work_queue.put_nowait((-topic.points, next(self.work_seq), topic))
+            self.executor_pool.grow()
+
+    async def wait_idle(self):
+        "Returns once no topic waits for moderation or generation"
+        #a moderated topic is dispatched before its moderation is marked done, so the second join sees it
+        await self.moderation_queue.join()
+        await self.work_queue.join()
+
+    def enqueue(self, topic: Topic):
+        mark(topic.timestamps, "queued")
+        if topic.index_key is None:
+            topic.index_key = self.topic_index.add(topic.topic)
+        self.topics.push(topic)
+        self.dispatch(topic)
 
     async def update_status(self, topic: Topic):
-        await asyncio.sleep(1)
-        should_consume = False 
-        if topic.is_from_db:
+        should_consume = False
+        if topic.is_from_db or topic.question:
             async with self.topics_lock:
                 topic.status ="successful"
+                self.topics.mark_successful(topic)
         else:
             async with self.topics_lock:
                 clone_topic = copy.copy(topic)
             try:
-                if clone_topic.status == "pending":
-                    llm_resp = await llm_req.topic_check(clone_topic.topic)
-                    if llm_resp == "No":
-                        status = "computing"
-                    else:
-                        status = "failed"
+                if clone_topic.status == "computing":
+                    content, speculation, topic.speculation = None, topic.speculation, None
+                    if speculation:
+                        try:
+                            content, generated = await speculation
+                        except Exception as e:
+                            logging.debug(f"Speculative generation failed for topic {topic.topic}, generating again: {e}")
+                    if content is None:
+                        content, generated = await self.fetch_question(topic)
+                    if generated:
+                        await self.topic_cache.put_question(clone_topic.topic, content)
                     async with self.topics_lock:
-                        topic.status = status
-                elif clone_topic.status == "computing":
-                    content = await llm_req.generate_question(clone_topic.topic)
-                    async with self.topics_lock:
-                        topic.question = Question(content["trivia question"],
-                                    content["option A"],
-                                    content["option B"],
-                                    content["option C"],
-                                    content["option D"],
-                                    content["correct answer"].replace(" ", "_"))
+                        topic.question = question_from_llm(content)
                         topic.status = "successful"
+                        self.topics.mark_successful(topic)
             except Exception as e:
                 error_message = str(e)
                 logging.debug("llm error: " + error_message)
@@ -170,7 +305,7 @@ class TaskManager:
             if topic.status == "successful" and self.current_topic is None:
                 should_consume = True
             if topic.status == "failed":
-                await asyncio.create_task(self.remove_failed_topic(topic))
+                asyncio.create_task(self.remove_failed_topic(topic))
         if should_consume:
             if self.task:
                 self.task.cancel()
@@ -178,21 +313,44 @@ class TaskManager:
             self.task = asyncio.create_task(self.count())
             await self.consume_successful_topic()
 
+    async def fetch_question(self, topic: Topic):
+        "Returns the question content for the topic and whether the LLM had to generate it"
+        mark(topic.timestamps, "generation_start")
+        content = await self.topic_cache.get_question(topic.topic)
+        if content is not None:
+            mark(topic.timestamps, "generation_end")
+            return content, False
+        async def show_progress(progress):
+            topic.progress = progress
+            if topic.status == "computing" and topic in self.topics.top(env_vars.NR_TOPICS_TO_BROADCAST):
+                await self.broadcast_next_topics()
+        content = await llm_req.generate_question(topic.topic, show_progress)
+        question_from_llm(content)  # don't cache malformed answers
+        mark(topic.timestamps, "generation_end")
+        return content, True
+
     async def consume_successful_topic(self):
         topic = None
         async with self.topics_lock:
-            successful_topics = [t for t in self.topics if t.status == "successful"]
-            if successful_topics:
-                topic = successful_topics[0]
+            topic = self.topics.best_successful()
+            if topic:
                 logging.debug(f"Topic obtained: {topic.topic}")
                 self.topics.remove(topic)
+                self.topic_index.expire(topic.index_key, env_vars.QUESTION_COUNTDOWN_SEC + env_vars.TOPIC_COOLDOWN_SEC)
+                topic.round_id = next(self.round_ids)
+                topic.option_fragments = render_option_fragments(topic.question, topic.round_id)
+                mark(topic.timestamps, "promoted")
                 self.current_topic = topic
                 self.current_topic_start_time = asyncio.get_event_loop().time()
                 self.current_timeout_task = asyncio.create_task(self.topic_timeout())
                 
         if topic:
             logging.debug(f"We have a topic to broadcast: {topic.topic}")
-            await self.broadcast_current_question()
+            def broadcast_done():
+                mark(topic.timestamps, "broadcast_end")
+                self.pipeline_trace.record(topic.timestamps, topic.source)
+            fanout = await self.broadcast_current_question()
+            fanout.add_done_callback(broadcast_done)
             await self.broadcast_next_topics()
             await self.compute_winners()
             await self.broadcast_past_topic()
@@ -224,54 +382,127 @@ class TaskManager:
                 self.reset()
             self.task = asyncio.create_task(self.count())
             self.past_topic = self.current_topic
+            if self.past_topic:
+                self.past_topic.answers.freeze()
             await self.consume_successful_topic()
 
     async def remove_failed_topic(self, topic: Topic):
         await asyncio.sleep(env_vars.KEEP_FAILED_TOPIC_SEC)
-        if topic in self.topics and topic.status == "failed":
-            self.topics.remove(topic)
+        async with self.topics_lock:
+            removed = topic.status == "failed" and self.topics.remove(topic)
+            if removed:
+                self.topic_index.remove(topic.index_key)
+        if removed:
             await self.broadcast_next_topics()
         logging.debug(f"Failed topic removed: {topic.topic}")
 
     async def monitor_topics(self):
         while True:
-            need_default_topics = False
-            async with self.topics_lock:
-                if all(topic.status in ["successful", "failed"] for topic in self.topics):
-                    need_default_topics = True
-
-            if need_default_topics:
-                await self.add_database_topics()
-            await asyncio.sleep(1)  # Check periodically
+            #the queues drain only once every topic is either successful or failed
+            await self.wait_idle()
+            await self.add_pregenerated_topics()
+            await self.add_database_topics()
+            await asyncio.sleep(1)
     
+    async def add_pregenerated_topics(self):
+        async with self.topics_lock:
+            missing = env_vars.MAX_NR_TOPICS_FOR_ALLOW_MORE - len(self.topics)
+            added = False
+            for topic_text, content in self.pregenerator.take(missing):
+                try:
+                    question = question_from_llm(content)
+                except Exception as e:
+                    logging.debug(f"Discarding malformed pre-generated question: {e}")
+                    continue
+                topic = Topic(points=0, topic=topic_text, user="[bot]", question=question)
+                self.enqueue(topic)
+                added = True
+            if added:
+                await self.broadcast_next_topics()
+                logging.debug("Pre-generated topics added")
+
     async def add_database_topics(self):
         async with self.topics_lock:
-            if len(self.topics) < env_vars.MAX_NR_TOPICS_FOR_ALLOW_MORE:
+            missing = env_vars.MAX_NR_TOPICS_FOR_ALLOW_MORE - len(self.topics)
+            if missing > 0:
                 try:
-                    trivia_recs = db.q(f"SELECT * FROM {trivias} ORDER BY RANDOM() LIMIT {env_vars.MAX_NR_TOPICS_FOR_ALLOW_MORE}")                   
+                    trivia_recs = await self.trivia_sampler.sample(missing)
                     for trivia_rec in trivia_recs:
-                        self.topics.append(
-                            Topic(points=0,
-                                  topic=trivia_rec["topic"],
-                                  user="[bot]", 
-                                  question=Question(trivia_rec["question"], trivia_rec["option_A"],  trivia_rec["option_B"], trivia_rec["option_C"], trivia_rec["option_D"], "option_{}".format(trivia_rec["correct_option"])),
-                                  is_from_db=True))
-                    self.topics = deque(sorted(self.topics, reverse=True))
+                        topic = Topic(points=0,
+                                      topic=trivia_rec["topic"],
+                                      user="[bot]", 
+                                      question=Question(trivia_rec["question"], trivia_rec["option_A"],  trivia_rec["option_B"], trivia_rec["option_C"], trivia_rec["option_D"], "option_{}".format(trivia_rec["correct_option"])),
+                                      is_from_db=True)
+                        self.enqueue(topic)
                     await self.broadcast_next_topics()
                     logging.debug("Default topics added")
                 except Exception as e:
                     error_message = str(e)
                     logging.debug("Issues when generating default topics: " + error_message)
 
-    async def add_user_topic(self, points, topic, user_id):
+    async def register_player(self, user_id, player_id, points):
+        if user_id in self.all_users:
+            return
+        self.all_users[user_id] = player_id
+        self.ledger.add_player(player_id, points)
+        self.leaderboard.add_player(player_id, user_id, points)
+
+    async def player_id(self, user_id):
+        "Players created by another worker are looked up once, in case their registration never reached this one"
+        if user_id not in self.all_users:
+            row = await adb.fetchone("SELECT id, points FROM players WHERE name = ?", (user_id,))
+            if row is None:
+                return None
+            await self.register_player(user_id, row['id'], row['points'])
+        return self.all_users[user_id]
+
+    async def login(self, user_id):
+        "Returns the player's points, creating the player on their first visit"
+        if self.broker.is_leader and self.all_users.get(user_id) is not None:
+            points = await self.ledger.balance(self.all_users[user_id])
+            if points is not None:
+                return points
+        row = await adb.fetchone("SELECT id, points FROM players WHERE name = ?", (user_id,))
+        if row:
+            return row['points']
+        player_id = await adb.execute("INSERT INTO players (name, points) VALUES (?, ?)", (user_id, 20))
+        await self.broker.submit("register_player", user_id=user_id, player_id=player_id, points=20)
+        return 20
+
+    async def bid(self, user_id, topic, points):
+        #reserves the topic right away so that two concurrent bids can't both pass the check
+        index_key, match = self.topic_index.claim(topic)
+        if match is not None:
+            await self.send_toast(f"Topic '{topic}' is very similar with an existing one. Please request another topic.", "info", user_id)
+            return
+        new_points = await self.ledger.debit(await self.player_id(user_id), points)
+        if new_points is None:
+            self.topic_index.remove(index_key)
+            await self.send_toast("Not enough points", "error", user_id)
+            return
+        await self.add_user_topic(topic=topic, points=points, user_id=user_id, index_key=index_key)
+        await self.send_to_user(Div(user_id + ": " + str(new_points) + " pts", cls='login', id='login_points'), user_id)
+
+    async def answer(self, user_id, option, round_id, submitted_at):
+        topic = self.current_topic
+        #only registered players can win points, and only on the question they saw
+        if topic is None or topic.round_id != round_id or option not in OPTIONS or await self.player_id(user_id) is None:
+            return
+        #timestamped by the worker serving the player, so answers relayed by other workers aren't ranked later
+        if not topic.answers.submit(user_id, option, submitted_at):
+            return
+        await self.send_to_user(topic.option_fragments[option], user_id)
+
+    async def add_user_topic(self, points, topic, user_id, index_key=None):
         async with self.topics_lock:
-            self.topics.append(Topic(points=points, topic=topic, user=user_id))
-            self.topics = deque(sorted(self.topics, reverse=True))
+            new_topic = Topic(points=points, topic=topic, user=user_id, index_key=index_key)
+            self.enqueue(new_topic)
+            self.pregenerator.yield_to_users()
             await self.broadcast_next_topics()
             logging.debug(f"User topic: {topic} added")
 
     async def broadcast_next_topics(self, client=None):
-        next_topics = list(self.topics)[:env_vars.NR_TOPICS_TO_BROADCAST]
+        next_topics = self.topics.top(env_vars.NR_TOPICS_TO_BROADCAST)
         status_dict = {
             'failed': '#dc552c',
             'pending': '#ede7dd',
@@ -279,64 +510,90 @@ class TaskManager:
             'successful': '#77ab59'
         }
         next_topics_html = [Div(Div(f"{item.topic if item.status not in ['pending', 'failed'] else 'Topic Censored'}"),
+                                Progress(value=int(item.progress * 100), max=100) if item.status == 'computing' and item.progress is not None else None,
                                 Div(item.user, cls="item left"), Div(f"{item.points} pts", cls="item right"),
                                 cls="card", style=f"background-color: {status_dict[item.status]}") for item in
                             next_topics]
         
-        await self.send_to_clients(Div(*next_topics_html, id="next_topics"), client)
+        await self.send_to_clients(Div(*next_topics_html, id="next_topics"), client, key="next_topics")
+
+    def deliver(self, payload, user_id=None):
+        "Pushes a rendered payload to this worker's own clients"
+        clients = self.presence.all_sends() if user_id is None else self.presence.sends_of(user_id)
+        return self.broadcaster.publish(payload, clients)
+
+    async def send_to_clients(self, element, client=None, key=None):
+        "Sends to every client of every worker, or only to `client`; `key` names the latest state replayed to new clients"
+        if client is not None:
+            return self.broadcaster.publish(element, [client])
+        return await self.broker.publish(render(element), key=key)
+
+    async def send_to_user(self, element, user_id):
+        await self.broker.publish(render(element), user_id=user_id)
+
+    async def send_toast(self, message, typ, user_id):
+        elem = Div(Div(Div(message, cls=f"toast toast-{typ}"), cls="toast-container"), hx_swap_oob="afterbegin:body")
+        await self.send_to_user(elem, user_id)
+
+    async def send_snapshot(self, send):
+        "Brings a freshly connected client up to date"
+        if self.broker.is_leader:
+            await self.broadcast_next_topics(send)
+            if self.current_topic:
+                await self.broadcast_current_question(send)
+                if env_vars.CLIENT_SIDE_COUNTDOWN and self.round_deadline:
+                    await self.broadcast_countdown(send)
+            await self.broadcast_past_topic(send)
+            return
+        states = await self.broker.get_states(["next_topics", "current_question", "round_deadline", "countdown", "past_topic"])
+        for key in ["next_topics", "current_question"]:
+            if key in states:
+                self.broadcaster.publish(states[key], [send])
+        if env_vars.CLIENT_SIDE_COUNTDOWN and "round_deadline" in states:
+            self.round_deadline = float(states["round_deadline"])
+            await self.broadcast_countdown(send)
+        elif "countdown" in states:
+            self.broadcaster.publish(states["countdown"], [send])
+        if "past_topic" in states:
+            self.broadcaster.publish(states["past_topic"], [send])
+
+    def remove_client(self, client):
+        "Called by the broadcaster when a client fell too far behind or its socket failed"
+        ws = self.presence.socket_of(client)
+        if ws is not None:
+            self.presence.disconnect(ws)
+            logging.debug(f"Removed dropped client: {client}")
+            asyncio.create_task(close_socket(ws))
 
-    async def send_to_clients(self, element, client=None):
-        with self.online_users_lock:
-            clients = (self.online_users if client is None else {'unknown': { 'ws_clients': [client]}}).copy()
-        for client in [item for subset in clients.values() for item in subset['ws_clients']]:
-            try:
-                await client(element)
-            except:
-                with self.online_users_lock:
-                    key_to_remove = None
-                    for key, clients_data in self.online_users.items():
-                        if client in clients_data['ws_clients']:
-                            clients_data['ws_clients'].remove(client)
-                            if len(clients_data['ws_clients']) == 0:
-                                key_to_remove = key
-                            logging.debug(f"Removed disconnected client: {client}")
-                            break
-                    if key_to_remove:
-                        self.online_users.pop(key_to_remove)
-                        
     async def compute_winners(self):
         if self.past_topic:
-            async with self.answers_lock:
-                self.past_topic.winners = [a[0] for a in self.past_topic.answers if a[1] == self.past_topic.question.correct_answer]
-            
-            ids = ", ".join([str(self.all_users[w]) for w in self.past_topic.winners])
-            db_players = db.q(f"select * from {players} where {players.c.id} in ({ids})")
-            
-            for db_winner in db_players:
-                winner_name = db_winner['name']
-                db_winner['points'] += (len(self.past_topic.winners) - self.past_topic.winners.index(winner_name)) * 10
-                    
-                self.online_users[winner_name]['combo_count'] += 1
-                if self.online_users[winner_name]['combo_count'] == env_vars.COMBO_CONSECUTIVE_NR_FOR_WIN:
-                    self.online_users[winner_name]['combo_count'] = 0
-                    db_winner['points'] += env_vars.COMBO_WIN_POINTS
-                    
-                    msg = f"Congratulations! You have earned {env_vars.COMBO_WIN_POINTS} extra points for answering {env_vars.COMBO_CONSECUTIVE_NR_FOR_WIN} questions correctly in a row."
-                    elem = Div(Div(Div(msg, cls=f"toast toast-info"), cls="toast-container"), hx_swap_oob="afterbegin:body")
-                    for client in self.online_users[winner_name]['ws_clients']:
-                        await self.send_to_clients(elem, client) 
-                        
-                players.update(db_winner)
-                elem = Div(winner_name + ": " + str(db_winner['points']) + " pts", cls='login', id='login_points')
-                for client in self.online_users[winner_name]['ws_clients']:
-                    await self.send_to_clients(elem, client)   
-            
-            #if you won last question, but not this one, then sorry, it has to be consecutive, so resetting to 0
-            for key, user_data in self.online_users.items():
-                if key not in self.past_topic.winners:
-                    user_data['combo_count'] = 0
-                
-                            
+            self.past_topic.winners = self.past_topic.answers.winners(self.past_topic.question.correct_answer)
+
+            self.round_nr += 1
+            winners = self.past_topic.winners
+            awards = []
+            combo_winners = []
+            for rank, winner_name in enumerate(winners):
+                award = (len(winners) - rank) * 10
+                #it has to be consecutive, so the streak only continues if you also won the previous round
+                last_won_round, streak = self.win_streaks.get(winner_name, (None, 0))
+                streak = streak + 1 if last_won_round == self.round_nr - 1 else 1
+                if streak == env_vars.COMBO_CONSECUTIVE_NR_FOR_WIN:
+                    streak = 0
+                    award += env_vars.COMBO_WIN_POINTS
+                    combo_winners.append(winner_name)
+                self.win_streaks[winner_name] = (self.round_nr, streak)
+                awards.append((award, self.all_users[winner_name]))
+
+            new_points = await self.ledger.credit(awards)
+
+            msg = f"Congratulations! You have earned {env_vars.COMBO_WIN_POINTS} extra points for answering {env_vars.COMBO_CONSECUTIVE_NR_FOR_WIN} questions correctly in a row."
+            for winner_name in combo_winners:
+                await self.send_toast(msg, "info", winner_name)
+            for winner_name in winners:
+                elem = Div(winner_name + ": " + str(new_points[self.all_users[winner_name]]) + " pts", cls='login', id='login_points')
+                await self.send_to_user(elem, winner_name)
+
     async def broadcast_past_topic(self, client=None):
         if self.past_topic:                
             ans = getattr(self.past_topic.question, self.past_topic.question.correct_answer)
@@ -344,11 +601,11 @@ class TaskManager:
                                    Div(B("Correct answer:"), P(ans)),
                                    Div(
                                         B("Winners:"),
-                                        Table(*[Tr(Td(winner), Td(f"{(len(self.past_topic.winners) - self.past_topic.winners.index(winner)) * 10} pts")) for winner in self.past_topic.winners]),
+                                        Table(*[Tr(Td(winner), Td(f"{(len(self.past_topic.winners) - rank) * 10} pts")) for rank, winner in enumerate(self.past_topic.winners)]),
                                   ),
                                   cls="past-card")
 
-            await self.send_to_clients(Div(past_topic_html, id="past_topic"), client)
+            await self.send_to_clients(Div(past_topic_html, id="past_topic"), client, key="past_topic")
 
     async def broadcast_current_question(self, client=None):
         current_question_info = Div(
@@ -357,204 +614,118 @@ class TaskManager:
                 Div(self.current_topic.user, cls="item left"),
                 Div(f"{self.current_topic.points} pts", cls="item right"),
                 cls="card"),
-            unselectedOptions()
+            NotStr(self.current_topic.option_fragments[None])
         )
-        await self.send_to_clients(Div(current_question_info, id="current_question_info"), client)
+        return await self.send_to_clients(Div(current_question_info, id="current_question_info"), client, key="current_question")
 
     async def count(self):
         self.countdown_var = env_vars.QUESTION_COUNTDOWN_SEC
+        self.round_deadline = time.time() + env_vars.QUESTION_COUNTDOWN_SEC
+        await self.broker.set_state("round_deadline", str(self.round_deadline))
+        if env_vars.CLIENT_SIDE_COUNTDOWN:
+            #the browser renders the ticking clock from the deadline (see clientCountdown)
+            await self.broadcast_countdown()
+            return
         while self.countdown_var >= 0:
             await self.broadcast_countdown()
             await asyncio.sleep(1)
             self.countdown_var -= 1
 
     async def broadcast_countdown(self, client=None):
+        deadline_attrs = {}
+        if env_vars.CLIENT_SIDE_COUNTDOWN:
+            now = time.time()
+            self.countdown_var = max(0, math.ceil(self.round_deadline - now))
+            deadline_attrs = dict(data_deadline=int(self.round_deadline * 1000), data_server_now=int(now * 1000))
         countdown_format = self.countdown_var if self.countdown_var >= 10 else f"0{self.countdown_var}"
         style = "color: red;" if self.countdown_var <= 5 else ""
-        countdown_div = Div(f"{countdown_format}", cls="countdown", style="text-align: center; font-size: 40px;" + style, id="countdown")
-        await self.send_to_clients(countdown_div, client)
+        countdown_div = Div(f"{countdown_format}", cls="countdown", style="text-align: center; font-size: 40px;" + style, id="countdown", **deadline_attrs)
+        await self.send_to_clients(countdown_div, client, key="countdown")
+
+async def random_db_topic():
+    row = await adb.fetchone("SELECT topic FROM trivias WHERE id >= 1 + abs(random()) % (SELECT max(id) FROM trivias) LIMIT 1")
+    return row['topic'] if row else None
 
 def ensure_db_tables():
     if players not in db.t:
-        players.create(id=int, name=str, points=int, pk='id')
+        players.create(id=int, name=str, points=int, pk='id', if_not_exists=True)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_players_name ON players (name)")
+
+def make_broker():
+    if env_vars.GAME_BROKER == "sqlite":
+        return SQLiteBroker(adb, env_vars.BROKER_POLL_SEC, env_vars.BROKER_LEASE_SEC)
+    return LocalBroker()
 
+async def start_topic_pipeline(task_manager):
     if trivias not in db.t:
-        #bulk import from HF dataset
-        dataset = load_dataset('Mihaiii/trivia_single_choice-4-options', split='train')
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-        CREATE TABLE trivias (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            topic TEXT NOT NULL,
-            question TEXT NOT NULL,
-            option_A TEXT NOT NULL,
-            option_B TEXT NOT NULL,
-            option_C TEXT NOT NULL,
-            option_D TEXT NOT NULL,
-            correct_option TEXT NOT NULL
-        );
-        ''')
-        conn.commit()
-        insert_query = "INSERT INTO trivias (topic, question, option_A, option_B, option_C, option_D, correct_option) VALUES (?, ?, ?, ?, ?, ?, ?)"
-        conn.execute('BEGIN TRANSACTION')
-        for record in dataset:
-            cursor.execute(insert_query, (record['topic'], record['question'], record['option_A'], record['option_B'], record['option_C'], record['option_D'], record['correct_option']))
-        conn.commit()
-        conn.close()
-        logging.debug("Count trivia rows:" + str(len(list(trivias.rows))))
-    
+        #bulk import in a worker thread, the server keeps booting and user bids are already processed meanwhile
+        try:
+            await asyncio.to_thread(trivia_import.import_trivias, db_path, env_vars.TRIVIA_DATASET_PATH)
+        except Exception as e:
+            logging.error(f"Trivia import failed, only user topics will be played: {e}")
+            return
+    task_manager.game_tasks.append(asyncio.create_task(task_manager.monitor_topics()))
+    if env_vars.PREGEN_BUFFER_SIZE > 0:
+        task_manager.game_tasks.append(asyncio.create_task(task_manager.pregenerator.run()))
+
 async def app_startup():
     ensure_db_tables()
-    num_executors = 2  # Change this to run more executors
-    task_manager = TaskManager(num_executors)
+    await llm_req.startup()
+    task_manager = TaskManager(make_broker())
     app.state.task_manager = task_manager
-    results = db.q(f"SELECT {players.c.name}, {players.c.id} FROM {players}")
-    task_manager.all_users = {row['name']: row['id'] for row in results}
-    asyncio.create_task(task_manager.monitor_topics())
-    for i in range(num_executors):
-        asyncio.create_task(task_manager.run_executor(i))
-
-
-app = FastHTML(hdrs=(css, ThemeSwitch()), ws_hdr=True, on_startup=[app_startup])
-rt = app.route
-setup_toasts(app)
+    await task_manager.topic_cache.create_tables()
+    app.state.loop_monitor_task = asyncio.create_task(loop_monitor.run())
+    #the broker calls start_game right away, or once this worker takes the lead
+    await task_manager.broker.start(task_manager)
 
-@rt('/choose_option_A')
-async def post(session, app):
-    if 'session_id' not in session:
-        add_toast(session, SIGN_IN_TEXT, "error")
-        return unselectedOptions()
-    
+async def app_shutdown():
     task_manager = app.state.task_manager
-    
-    async with task_manager.answers_lock:
-        task_manager.current_topic.answers = [a for a in task_manager.current_topic.answers if a[0] != session['session_id']]
-        task_manager.current_topic.answers.append((session['session_id'], "option_A"))
-        
-    div_a = Div(
-        Button(task_manager.current_topic.question.option_A, cls="primarly", hx_post="/choose_option_A",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_B, cls="secondary", hx_post="/choose_option_B",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_C, cls="secondary", hx_post="/choose_option_C",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_D, cls="secondary", hx_post="/choose_option_D",
-               hx_target="#question_options", disabled=True),
-        cls="options",
-        style="display: flex; flex-direction: column; gap: 10px; ",
-        id="question_options"
-    )
-    
-    for client in task_manager.online_users[session['session_id']]['ws_clients']:
-        await task_manager.send_to_clients(div_a, client)
+    app.state.loop_monitor_task.cancel()
+    await llm_req.shutdown()
+    await task_manager.broker.stop()
+    if task_manager.broker.is_leader:
+        await task_manager.stop_game()
+    adb.close()
 
 
-@rt('/choose_option_B')
-async def post(session):
-    if 'session_id' not in session:
-        add_toast(session, SIGN_IN_TEXT, "error")
-        return unselectedOptions()
-    
-    task_manager = app.state.task_manager
-    
-    async with task_manager.answers_lock:
-        task_manager.current_topic.answers = [a for a in task_manager.current_topic.answers if a[0] != session['session_id']]
-        task_manager.current_topic.answers.append((session['session_id'], "option_B"))
-    
-    div_b = Div(
-        Button(task_manager.current_topic.question.option_A, cls="secondary", hx_post="/choose_option_A",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_B, cls="primarly", hx_post="/choose_option_B",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_C, cls="secondary", hx_post="/choose_option_C",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_D, cls="secondary", hx_post="/choose_option_D",
-               hx_target="#question_options", disabled=True),
-        cls="options",
-        style="display: flex; flex-direction: column; gap: 10px; ",
-        id="question_options"
-    )
-    
-    for client in task_manager.online_users[session['session_id']]['ws_clients']:
-        await task_manager.send_to_clients(div_b, client)
+app = FastHTML(hdrs=(css, ThemeSwitch()), ws_hdr=True, on_startup=[app_startup], on_shutdown=[app_shutdown])
+rt = app.route
+setup_toasts(app)
 
+OPTIONS = ["option_A", "option_B", "option_C", "option_D"]
 
-@rt('/choose_option_C')
-async def post(session, app):
-    if 'session_id' not in session:
-        add_toast(session, SIGN_IN_TEXT, "error")
-        return unselectedOptions()
-    
-    task_manager = app.state.task_manager
-    
-    async with task_manager.answers_lock:
-        task_manager.current_topic.answers = [a for a in task_manager.current_topic.answers if a[0] != session['session_id']]
-        task_manager.current_topic.answers.append((session['session_id'], "option_C"))
-        
-    div_c = Div(
-        Button(task_manager.current_topic.question.option_A, cls="secondary", hx_post="/choose_option_A",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_B, cls="secondary", hx_post="/choose_option_B",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_C, cls="primarly", hx_post="/choose_option_C",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_D, cls="secondary", hx_post="/choose_option_D",
-               hx_target="#question_options", disabled=True),
+def options_fragment(question, round_id, selected=None):
+    if selected is None:
+        buttons = [Button(getattr(question, option), cls="primary", hx_post="/choose_option", hx_vals={"option": option, "round_id": round_id},
+                          hx_target="#question_options") for option in OPTIONS]
+    else:
+        buttons = [Button(getattr(question, option), cls="primarly" if option == selected else "secondary", hx_post="/choose_option",
+                          hx_vals={"option": option, "round_id": round_id}, hx_target="#question_options", disabled=True) for option in OPTIONS]
+    return Div(
+        *buttons,
         cls="options",
         style="display: flex; flex-direction: column; gap: 10px; ",
         id="question_options"
     )
-    
-    for client in task_manager.online_users[session['session_id']]['ws_clients']:
-        await task_manager.send_to_clients(div_c, client)
 
+def render_option_fragments(question, round_id):
+    "The unselected options (key None) and one variant per selected option, serialized once per question"
+    return {selected: render(options_fragment(question, round_id, selected)) for selected in [None, *OPTIONS]}
 
-@rt('/choose_option_D')
-async def post(session):
+@rt('/choose_option')
+async def post(session, app, option: str, round_id: int):
     if 'session_id' not in session:
         add_toast(session, SIGN_IN_TEXT, "error")
-        return unselectedOptions()
+        return HttpHeader("HX-Reswap", "none")
     
     task_manager = app.state.task_manager
-    
-    async with task_manager.answers_lock:
-        task_manager.current_topic.answers = [a for a in task_manager.current_topic.answers if a[0] != session['session_id']]
-        task_manager.current_topic.answers.append((session['session_id'], "option_D"))
-        
-    div_d = Div(
-        Button(task_manager.current_topic.question.option_A, cls="secondary", hx_post="/choose_option_A",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_B, cls="secondary", hx_post="/choose_option_B",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_C, cls="secondary", hx_post="/choose_option_C",
-               hx_target="#question_options", disabled=True),
-        Button(task_manager.current_topic.question.option_D, cls="primarly", hx_post="/choose_option_D",
-               hx_target="#question_options", disabled=True),
-        cls="options",
-        style="display: flex; flex-direction: column; gap: 10px; ",
-        id="question_options"
-    )
-    
-    for client in task_manager.online_users[session['session_id']]['ws_clients']:
-        await task_manager.send_to_clients(div_d, client)
-
-
-def unselectedOptions():
-    task_manager = app.state.task_manager
-    return Div(
-        Button(task_manager.current_topic.question.option_A, cls="primary", hx_post="/choose_option_A",
-                hx_target="#question_options"),
-        Button(task_manager.current_topic.question.option_B, cls="primary", hx_post="/choose_option_B",
-                hx_target="#question_options"),
-        Button(task_manager.current_topic.question.option_C, cls="primary", hx_post="/choose_option_C",
-                hx_target="#question_options"),
-        Button(task_manager.current_topic.question.option_D, cls="primary", hx_post="/choose_option_D",
-                hx_target="#question_options"),
-        cls="options",
-        style="display: flex; flex-direction: column; gap: 10px; ",
-        id="question_options"
-    )
+    await task_manager.broker.submit("answer", user_id=session['session_id'], option=option, round_id=round_id, submitted_at=time.time())
+    #the selected options also come over the websocket, to every tab of the player
+    topic = task_manager.current_topic
+    if task_manager.broker.is_leader and topic and topic.answers.option(session['session_id']):
+        return NotStr(topic.option_fragments[topic.answers.option(session['session_id'])])
+    #an empty body would be swapped in, wiping the options the websocket already updated
+    return HttpHeader("HX-Reswap", "none")
 
 
 def bid_form():
@@ -619,19 +790,7 @@ async def get(session, app, request):
     if 'session_id' in session:
         user_id = session['session_id']
         
-        if user_id not in task_manager.all_users:
-            task_manager.all_users[user_id] = None
-            
-        db_player = db.q(f"select * from {players} where {players.c.id} = '{task_manager.all_users[user_id]}'")
-    
-        if not db_player:
-            current_points = 20
-            players.insert({'name': user_id, 'points': current_points})
-            query = f"SELECT {players.c.id} FROM {players} WHERE {players.c.name} = ?"
-            result = db.q(query, (user_id,))
-            task_manager.all_users[user_id] = result[0]['id']
-        else:
-            current_points = db_player[0]['points']
+        current_points = await task_manager.login(user_id)
 
     current_question_info = Div(id="current_question_info")
     left_panel = Div(
@@ -691,7 +850,7 @@ async def get(session, app, request):
         hx_ext='ws', ws_connect='/ws'
     )
     
-    return Title("Trivia"), Div(container, enterToBid())
+    return Title("Trivia"), Div(container, enterToBid(), clientCountdown())
 
 @rt("/how-to-play")
 def get(app, session):
@@ -707,17 +866,33 @@ def get(app, session):
              )
     return Title("Trivia"), Div(tabs, rules, style="font-size: 20px;", cls="container")
 
+def leaderboard_table(top):
+    cells = [Tr(Td(f"{idx}.", style="padding: 5px; width: 50px; text-align: center;"), Td(name, style="padding: 5px;"), Td(points, style="padding: 5px; text-align: center;")) for idx, (name, points) in enumerate(top, start=1)]
+    return Table(Tr(Th(B("Rank")), Th(B('HuggingFace Username')), Th(B("Points"), style="text-align: center;")), *cells)
+
 @rt('/stats')
 async def get(session, app, request):
     task_manager = app.state.task_manager
-    db_player = db.q(f"select * from {players} order by points desc limit 20")
-    cells = [Tr(Td(f"{idx}.", style="padding: 5px; width: 50px; text-align: center;"), Td(row['name'], style="padding: 5px;"), Td(row['points'], style="padding: 5px; text-align: center;")) for idx, row in enumerate(db_player, start=1)]
-    with task_manager.online_users_lock:
-        c = [c for c in task_manager.online_users if c != "unassigned_clients"]
+    leaderboard = task_manager.leaderboard
+    own_rank = None
+    if task_manager.broker.is_leader:
+        #only rebuilt when a score change reaches the top of the table
+        if leaderboard.fragment is None:
+            leaderboard.fragment = NotStr(render(leaderboard_table(leaderboard.top())))
+        table = leaderboard.fragment
+        if 'session_id' in session and task_manager.all_users.get(session['session_id']) is not None:
+            rank = leaderboard.rank(task_manager.all_users[session['session_id']])
+            if rank is not None:
+                own_rank = Div(f"Your rank: {rank} of {len(leaderboard.ranking)}", style="text-align: center;")
+    else:
+        #the in-memory leaderboard lives on the worker leading the game, the others read the flushed points
+        rows = await adb.fetchall("SELECT name, points FROM players ORDER BY points DESC LIMIT ?", (LEADERBOARD_SIZE,))
+        table = leaderboard_table([(row['name'], row['points']) for row in rows])
+    c = await task_manager.broker.online_users()
         
     main_content = Div(
         Div(H2("Logged in users (" + str(len(c)) + "):"), Div(", ".join(c))),
-        Div(H1("Leaderboard", style="text-align: center;"), Table(Tr(Th(B("Rank")), Th(B('HuggingFace Username')), Th(B("Points"), style="text-align: center;")), *cells))
+        Div(H1("Leaderboard", style="text-align: center;"), own_rank, table)
     )
     return Title("Trivia"), Div(
         tabs,
@@ -725,6 +900,28 @@ async def get(session, app, request):
         cls="container"
     )
 
+@rt('/admin/pipeline')
+async def get(session, app, source: str = None):
+    "Latency histograms of the topic pipeline stages, optionally for one source (user, bot or db)"
+    if session.get('session_id') not in env_vars.ADMIN_USERS:
+        return Response("Forbidden", status_code=403)
+    task_manager = app.state.task_manager
+    #the pipeline runs on the worker leading the game, the others have nothing to report
+    return {"leader": task_manager.broker.is_leader, "stages": task_manager.pipeline_trace.summary(source)}
+
+@rt('/admin/slow_callbacks')
+async def get(session):
+    "The last times this worker's event loop was blocked, with the code blocking it"
+    if session.get('session_id') not in env_vars.ADMIN_USERS:
+        return Response("Forbidden", status_code=403)
+    reports = [f"{r['at']}: blocked for more than {r['blocked_sec']}s in:\n{r['stack']}" for r in reversed(loop_monitor.reports)]
+    return Response("\n".join(reports) or "No slow callbacks", media_type="text/plain")
+
+@rt('/metrics')
+async def get():
+    "This worker's metrics, in the Prometheus text format"
+    return Response(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @rt('/faq')
 async def get(session, app, request):
     qa = [
@@ -785,77 +982,35 @@ async def post(session, topic: str, points: int):
         add_toast(session, "Cannot send empty topic", "error")
         return bid_form()
 
-    if similar(topic, "ignore previous instructions") >= 0.5:
-        add_toast(session, "Error", "error")
-        return bid_form()
-
-    task_manager = app.state.task_manager
-
-    async with task_manager.topics_lock:
-        if similar(topic, task_manager.current_topic.topic) >= env_vars.DUPLICATE_TOPIC_THRESHOLD:
-            add_toast(session, f"Topic '{topic}' is very similar with an existing one. Please request another topic.")
-            return bid_form()
-
-        for t in task_manager.topics:
-            if similar(t.topic, topic) >= env_vars.DUPLICATE_TOPIC_THRESHOLD:
-                add_toast(session, f"Topic '{topic}' is very similar with an existing one. Please request another topic.")
-                return bid_form()
-            
-        if task_manager.past_topic:
-            if similar(t.topic, task_manager.past_topic.topic) >= env_vars.DUPLICATE_TOPIC_THRESHOLD:
-                add_toast(session, f"Topic '{topic}' is very similar with an existing one. Please request another topic.")
-                return bid_form()
-
-    if 'session_id' in session:
-        user_id = session['session_id']
-        db_player = db.q(f"select * from {players} where {players.c.id} = '{task_manager.all_users[user_id]}'")
-        if db_player[0]['points'] - points >= 0:
-            db_player[0]['points'] -= points
-            players.update(db_player[0])
+    #the duplicate check and the points debit run on the worker leading the game, which answers over the websocket
+    await app.state.task_manager.broker.submit("bid", user_id=session['session_id'], topic=topic, points=points)
+    return bid_form()
 
-            await task_manager.add_user_topic(topic=topic, points=points, user_id=user_id)
-            elem = Div(user_id + ": " + str(db_player[0]['points']) + " pts", cls='login', id='login_points')
 
-            for client in task_manager.online_users[user_id]['ws_clients']:
-                await task_manager.send_to_clients(elem, client)
-        else:
-            add_toast(session, "Not enough points", "error")
-    return bid_form()
+async def close_socket(ws):
+    try:
+        await ws.close()
+    except Exception as e:
+        logging.debug(f"Closing dropped socket failed: {e}")
 
 
 async def on_connect(send, ws):
-    client_key = "unassigned_clients"
-    if ws.scope['session'] and ws.scope['session']['session_id']:
-        client_key = ws.scope['session']['session_id']        
+    user_id = ws.scope['session'].get('session_id') if ws.scope['session'] else None
     task_manager = app.state.task_manager
-    with task_manager.online_users_lock:
-        if client_key not in task_manager.online_users:
-            task_manager.online_users[client_key] = { 'ws_clients': set(), 'combo_count': 0}
-        task_manager.online_users[client_key]['ws_clients'].add(send)
-    await task_manager.broadcast_next_topics(send)
-    if task_manager.current_topic:
-        await task_manager.broadcast_current_question(send)
-    await task_manager.broadcast_past_topic(send)
+    task_manager.presence.connect(ws, send, user_id)
+    await task_manager.send_snapshot(send)
 
 
-async def on_disconnect(send, session):
+async def on_disconnect(ws, session):
     logging.debug("Calling on_disconnect")
-    logging.debug(len(app.state.task_manager.online_users))
     task_manager = app.state.task_manager
-    with task_manager.online_users_lock:
-        key_to_remove = None
-        for key, user_data in task_manager.online_users.items():
-            if send in user_data['ws_clients']:
-                user_data['ws_clients'].remove(send)
-                if len(user_data['ws_clients']) == 0:
-                    key_to_remove = key
-                break
-            
-        if key_to_remove:
-            task_manager.online_users.pop(key_to_remove)
-                    
-        if session:
-            session['session_id'] = None
+    #the send passed to this handler is a new partial, so the socket is looked up by ws
+    send = task_manager.presence.disconnect(ws)
+    if send is not None:
+        task_manager.broadcaster.discard(send)
+    logging.debug(len(task_manager.presence))
+    if session:
+        session['session_id'] = None
 
 
 @app.ws('/ws', conn=on_connect, disconn=on_disconnect)
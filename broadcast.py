@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+from fasthtml.common import to_xml
+import metrics
+
+
+def render(element):
+    "Serialize an FT tree once so the same payload can be pushed to every socket"
+    if isinstance(element, (list, tuple)) or hasattr(element, '__ft__'):
+        return to_xml(element)
+    return element
+
+
+class Fanout:
+    "One published payload, timed from publishing until the send to its last recipient completes"
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.published_at = time.monotonic()
+        self.pending = 0  # recipients whose send didn't complete yet
+        self.callbacks = []
+
+    def add_done_callback(self, callback):
+        "Calls `callback()` once the send to the last recipient completed, right away if no send is left"
+        if self.pending == 0:
+            callback()
+        else:
+            self.callbacks.append(callback)
+
+    def done(self):
+        self.pending -= 1
+        if self.pending == 0:
+            metrics.observe("trivia_broadcast_seconds", time.monotonic() - self.published_at, metrics.FAST_BUCKETS)
+            for callback in self.callbacks:
+                callback()
+
+
+class ClientChannel:
+    "A bounded send queue per WebSocket client, drained by its own writer task"
+
+    def __init__(self, send, maxsize, on_drop):
+        self.send = send
+        self.queue = asyncio.Queue(maxsize)
+        self.on_drop = on_drop
+        self.closed = False
+        self.writer = asyncio.create_task(self._drain())
+
+    def offer(self, fanout):
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(fanout)
+            fanout.pending += 1
+            return True
+        except asyncio.QueueFull:
+            logging.debug(f"Send queue full, dropping slow client: {self.send}")
+            metrics.inc("trivia_ws_send_failures_total", reason="queue_full")
+            self.close()
+            self.on_drop(self.send)
+            return False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.writer is not asyncio.current_task():
+                self.writer.cancel()
+            #a dropped client no longer holds back the fan-out of the messages it was waiting for
+            while not self.queue.empty():
+                self.queue.get_nowait().done()
+
+    async def _drain(self):
+        try:
+            while True:
+                fanout = await self.queue.get()
+                try:
+                    await self.send(fanout.payload)
+                finally:
+                    fanout.done()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.debug(f"Send failed for client {self.send}: {e}")
+            metrics.inc("trivia_ws_send_failures_total", reason="send_error")
+            self.close()
+            self.on_drop(self.send)
+
+
+class Broadcaster:
+    "Fans a rendered message out to many clients without waiting on any of them"
+
+    def __init__(self, queue_size, on_drop):
+        self.queue_size = queue_size
+        self.on_drop = on_drop
+        self.channels = {}
+
+    def _channel(self, send):
+        channel = self.channels.get(send)
+        if channel is None or channel.closed:
+            channel = self.channels[send] = ClientChannel(send, self.queue_size, self._dropped)
+        return channel
+
+    def _dropped(self, send):
+        self.channels.pop(send, None)
+        self.on_drop(send)
+
+    def discard(self, send):
+        channel = self.channels.pop(send, None)
+        if channel:
+            channel.close()
+
+    def publish(self, element, clients):
+        fanout = Fanout(render(element))
+        for send in clients:
+            self._channel(send).offer(fanout)
+        return fanout
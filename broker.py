@@ -0,0 +1,201 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+
+# SECONDS AN EVENT STAYS IN THE SHARED LOG, LONG ENOUGH FOR EVERY WORKER TO HAVE RELAYED IT
+EVENT_RETENTION_SEC = 60
+
+
+class LocalBroker:
+    """Game state broker for a single process: this worker always leads, commands run right away and
+    events go straight to its own clients.
+
+    `game` is the TaskManager. The broker uses its `deliver(payload, user_id)`, `commands` (name -> coroutine function),
+    `start_game()`, `stop_game()` and `presence`."""
+
+    def __init__(self):
+        self.game = None
+        self.is_leader = False
+        self.states = {}
+
+    async def start(self, game):
+        self.game = game
+        self.is_leader = True
+        await game.start_game()
+
+    async def stop(self):
+        pass
+
+    async def publish(self, payload, user_id=None, key=None):
+        """Sends a rendered payload to every client (or only `user_id`'s); `key` keeps it as the latest state for late joiners.
+
+        Returns the Fanout to this worker's own clients."""
+        if key:
+            self.states[key] = payload
+        return self.game.deliver(payload, user_id)
+
+    async def set_state(self, key, value):
+        self.states[key] = value
+
+    async def get_states(self, keys):
+        return {key: self.states[key] for key in keys if key in self.states}
+
+    async def submit(self, command, **args):
+        "Runs a state changing command on the leader"
+        await self.game.commands[command](**args)
+
+    async def online_users(self):
+        return list(self.game.presence.users())
+
+
+class SQLiteBroker(LocalBroker):
+    """Lets several workers, each serving its own WebSocket clients, share one game through the SQLite database.
+
+    The worker holding the lease runs the game. Other workers queue their bids and answers as commands for it.
+    Every worker tails the event log and relays the events to its own clients. A leader that stops renewing
+    its lease for `lease_sec` is replaced by another worker."""
+
+    def __init__(self, adb, poll_sec, lease_sec):
+        super().__init__()
+        self.adb = adb
+        self.poll_sec = poll_sec
+        self.lease_sec = lease_sec
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.last_event = 0
+        self.task = None
+
+    async def start(self, game):
+        self.game = game
+        self.last_event = await self.adb.run(self._create_tables)
+        await self._renew_lease()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+        if self.is_leader:
+            await self.adb.execute("UPDATE broker_lease SET expires_at = 0 WHERE id = 1 AND worker = ?", (self.worker,))
+
+    async def publish(self, payload, user_id=None, key=None):
+        fanout = self.game.deliver(payload, user_id)
+        await self.adb.run(self._publish, payload, user_id, key, time.time())
+        return fanout
+
+    async def set_state(self, key, value):
+        await self.adb.execute("INSERT OR REPLACE INTO broker_state (key, value) VALUES (?, ?)", (key, value))
+
+    async def get_states(self, keys):
+        rows = await self.adb.fetchall(f"SELECT key, value FROM broker_state WHERE key IN ({', '.join('?' * len(keys))})", keys)
+        return {row['key']: row['value'] for row in rows}
+
+    async def submit(self, command, **args):
+        if self.is_leader:
+            await super().submit(command, **args)
+        else:
+            await self.adb.execute("INSERT INTO broker_commands (name, args, created_at) VALUES (?, ?, ?)",
+                                   (command, json.dumps(args), time.time()))
+
+    async def online_users(self):
+        rows = await self.adb.fetchall("SELECT worker, users FROM broker_presence WHERE updated_at >= ?", (time.time() - self.lease_sec,))
+        users = dict.fromkeys(self.game.presence.users())
+        for row in rows:
+            if row['worker'] != self.worker:
+                users.update(dict.fromkeys(json.loads(row['users'])))
+        return list(users)
+
+    async def _run(self):
+        next_renewal = time.monotonic() + self.lease_sec / 3
+        while True:
+            await asyncio.sleep(self.poll_sec)
+            try:
+                if time.monotonic() >= next_renewal:
+                    next_renewal = time.monotonic() + self.lease_sec / 3
+                    await self._renew_lease()
+                events, commands = await self.adb.run(self._poll, self.last_event, self.is_leader, time.time())
+                for event_id, worker, user_id, payload in events:
+                    self.last_event = event_id
+                    if worker != self.worker:  # our own events were delivered when published
+                        self.game.deliver(payload, user_id)
+                for name, args in commands:
+                    try:
+                        await super().submit(name, **json.loads(args))
+                    except Exception as e:
+                        logging.error(f"Broker command {name} failed: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Broker poll failed: {e}")
+
+    async def _renew_lease(self):
+        users = json.dumps(list(self.game.presence.users()))
+        leader = await self.adb.run(self._lease, users, time.time())
+        if leader and not self.is_leader:
+            logging.info(f"Worker {self.worker} now runs the game")
+            self.is_leader = True
+            await self.game.start_game()
+        elif not leader and self.is_leader:
+            logging.error(f"Worker {self.worker} lost the game lease, stopping its game loop")
+            self.is_leader = False
+            await self.game.stop_game()
+
+    def _create_tables(self, conn):
+        conn.executescript('''
+        CREATE TABLE IF NOT EXISTS broker_lease (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            worker TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS broker_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            worker TEXT NOT NULL,
+            user_id TEXT,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS broker_commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            args TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS broker_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS broker_presence (
+            worker TEXT PRIMARY KEY,
+            users TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        ''')
+        # a new worker only relays what happens from now on
+        return conn.execute("SELECT coalesce(max(id), 0) FROM broker_events").fetchone()[0]
+
+    def _lease(self, conn, users, now):
+        conn.execute("INSERT OR IGNORE INTO broker_lease (id, worker, expires_at) VALUES (1, ?, 0)", (self.worker,))
+        leader = conn.execute("UPDATE broker_lease SET worker = ?, expires_at = ? WHERE id = 1 AND (worker = ? OR expires_at < ?)",
+                              (self.worker, now + self.lease_sec, self.worker, now)).rowcount == 1
+        conn.execute("INSERT OR REPLACE INTO broker_presence (worker, users, updated_at) VALUES (?, ?, ?)", (self.worker, users, now))
+        if leader:
+            conn.execute("DELETE FROM broker_events WHERE created_at < ?", (now - EVENT_RETENTION_SEC,))
+            conn.execute("DELETE FROM broker_presence WHERE updated_at < ?", (now - EVENT_RETENTION_SEC,))
+        return leader
+
+    def _publish(self, conn, payload, user_id, key, now):
+        conn.execute("INSERT INTO broker_events (worker, user_id, payload, created_at) VALUES (?, ?, ?, ?)", (self.worker, user_id, payload, now))
+        if key:
+            conn.execute("INSERT OR REPLACE INTO broker_state (key, value) VALUES (?, ?)", (key, payload))
+
+    def _poll(self, conn, last_event, is_leader, now):
+        events = conn.execute("SELECT id, worker, user_id, payload FROM broker_events WHERE id > ? ORDER BY id", (last_event,)).fetchall()
+        commands = []
+        if is_leader:
+            rows = conn.execute("SELECT id, name, args, created_at FROM broker_commands ORDER BY id").fetchall()
+            if rows:
+                conn.execute("DELETE FROM broker_commands WHERE id <= ?", (rows[-1][0],))
+            # commands queued while no worker was leading are stale (the round they were meant for is over)
+            commands = [(name, args) for _, name, args, created_at in rows if created_at >= now - self.lease_sec]
+        return [tuple(e) for e in events], commands
@@ -0,0 +1,67 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=134217728",
+]
+
+
+class AsyncDB:
+    "Runs SQLite work on a small pool of worker threads, each with its own connection, so queries never block the event loop"
+
+    def __init__(self, db_path, nr_connections):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections = []
+        self._executor = ThreadPoolExecutor(max_workers=nr_connections, thread_name_prefix="sqlite", initializer=self._connect)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        self._local.conn = conn
+        self._connections.append(conn)
+
+    def _call(self, fn, args):
+        conn = self._local.conn
+        start = time.monotonic()
+        try:
+            with conn:  # commits on success, rolls back on error
+                return fn(conn, *args)
+        finally:
+            metrics.observe("trivia_sqlite_query_seconds", time.monotonic() - start, metrics.FAST_BUCKETS)
+
+    async def run(self, fn, *args):
+        "Calls `fn(conn, *args)` in a transaction on one of the worker connections"
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: [dict(row) for row in conn.execute(sql, params)])
+
+    async def fetchone(self, sql, params=()):
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    async def execute(self, sql, params=()):
+        "Returns the id of the last inserted row"
+        return await self.run(lambda conn: conn.execute(sql, params).lastrowid)
+
+    async def executemany(self, sql, seq_of_params):
+        return await self.run(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
@@ -3,6 +3,9 @@ import os
 # HOW MUCH TIME USERS HAVE TO ANSWER THE QUESTION? IN PROD WILL PROBABLY BE 18 or 20.
 QUESTION_COUNTDOWN_SEC = int(os.environ.get("QUESTION_COUNTDOWN_SEC", 22))
         
+# SEND THE ROUND DEADLINE ONCE AND LET THE BROWSER TICK THE CLOCK, INSTEAD OF SENDING EVERY SECOND
+CLIENT_SIDE_COUNTDOWN = bool(int(os.environ.get("CLIENT_SIDE_COUNTDOWN", 1)))
+
 # NUMBER OF SECONDS TO KEEP THE FAILED TOPIC IN THE UI (USER INTERFACE) BEFORE REMOVING IT FROM THE LIST
 KEEP_FAILED_TOPIC_SEC = int(os.environ.get("KEEP_FAILED_TOPIC_SEC", 5))
         
@@ -12,23 +15,69 @@ MAX_TOPIC_LENGTH_CHARS = int(os.environ.get("MAX_TOPIC_LENGTH_CHARS", 30))
 # AUTOMATICALLY ADD TOPICS IF THE USERS DON'T BID/PROPOSE NEW ONES
 MAX_NR_TOPICS_FOR_ALLOW_MORE = int(os.environ.get("MAX_NR_TOPICS_FOR_ALLOW_MORE", 20))
 
+# NUMBER OF LLM GENERATED QUESTIONS (FOR BOT PICKED TOPICS) TO KEEP READY WHILE NOBODY BIDS. 0 DISABLES IT.
+PREGEN_BUFFER_SIZE = int(os.environ.get("PREGEN_BUFFER_SIZE", 5))
+
 # NUMBER OF TOPICS TO APPEAR IN THE UI. THE ACTUAL LIST CAN CONTAIN MORE THAN THIS.
 NR_TOPICS_TO_BROADCAST = int(os.environ.get("NR_TOPICS_TO_BROADCAST", 5))
 
 # MINIMUM NUMBER OF POINTS REQUIRED TO PLACE A TOPIC BID IN THE UI
 BID_MIN_POINTS = int(os.environ.get("BID_MIN_POINTS", 3))
     
+# HOW LONG (SECONDS) A CACHED MODERATION VERDICT OR GENERATED QUESTION FOR A TOPIC STAYS VALID
+TOPIC_CACHE_TTL_SEC = int(os.environ.get("TOPIC_CACHE_TTL_SEC", 7 * 24 * 3600))
+
+# MAX NUMBER OF TOPICS KEPT IN THE CACHE. THE LEAST RECENTLY USED ONES ARE EVICTED FIRST.
+TOPIC_CACHE_MAX_TOPICS = int(os.environ.get("TOPIC_CACHE_MAX_TOPICS", 1000))
+
+# HOW MANY GENERATED QUESTIONS TO KEEP PER TOPIC. THE LLM IS SKIPPED ONLY ONCE THE POOL IS FULL.
+TOPIC_CACHE_QUESTIONS_PER_TOPIC = int(os.environ.get("TOPIC_CACHE_QUESTIONS_PER_TOPIC", 5))
+
 # MAX LENGTH OF THE USER PROVIDED TOPIC (WE REDUCE MALICIOUS INPUT)
 TOPIC_MAX_LENGTH = int(os.environ.get("TOPIC_MAX_LENGTH", 25))
+
+# FILE WITH ONE CASE INSENSITIVE REGEX PER LINE. MATCHING TOPICS ARE REJECTED WITHOUT ASKING THE LLM.
+MODERATION_BLOCKLIST_PATH = os.environ.get("MODERATION_BLOCKLIST_PATH", "")
+
+# BIDS OF AT LEAST THIS MANY POINTS GET THEIR QUESTION GENERATED WHILE THE TOPIC IS MODERATED. 0 DISABLES IT.
+SPECULATIVE_GEN_MIN_POINTS = int(os.environ.get("SPECULATIVE_GEN_MIN_POINTS", 0))
     
 DUPLICATE_TOPIC_THRESHOLD = float(os.environ.get("DUPLICATE_TOPIC_THRESHOLD", 0.9))
 
+# NUMBER OF SECONDS AFTER A TOPIC WAS PLAYED DURING WHICH A SIMILAR TOPIC CAN'T BE BID AGAIN
+TOPIC_COOLDOWN_SEC = int(os.environ.get("TOPIC_COOLDOWN_SEC", 300))
+
 #How many consecutive question does a user have to answer in order to win combo points?
 COMBO_CONSECUTIVE_NR_FOR_WIN = int(os.environ.get("COMBO_CONSECUTIVE_NR_FOR_WIN", 3))
 
 #How many points does a combo bonus offer?
 COMBO_WIN_POINTS = int(os.environ.get("COMBO_WIN_POINTS", 50))
 
+# MAX NUMBER OF MESSAGES WAITING TO BE SENT TO A SINGLE WEBSOCKET CLIENT. SLOWER CLIENTS ARE DROPPED.
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", 64))
+
+# MAX CONCURRENT REQUESTS PER LLM BACKEND. KEEP IN SYNC WITH THE LLAMA-SERVER --parallel SLOTS.
+TOPIC_CHECK_PARALLEL = int(os.environ.get("TOPIC_CHECK_PARALLEL", 4))
+GEN_Q_PARALLEL = int(os.environ.get("GEN_Q_PARALLEL", 3))
+
+# BOUNDS OF THE QUESTION GENERATION EXECUTORS. THEY ARE ADDED AND REMOVED WITH THE BACKLOG, UP TO THE GENERATOR SLOTS.
+MIN_EXECUTORS = int(os.environ.get("MIN_EXECUTORS", 2))
+MAX_EXECUTORS = int(os.environ.get("MAX_EXECUTORS", 16))
+
+# COMMA SEPARATED LLAMA-SERVER BASE URLS. ADD MORE SERVERS TO SPREAD THE LOAD.
+TOPIC_CHECK_URLS = [url.strip() for url in os.environ.get("TOPIC_CHECK_URLS", "http://127.0.0.1:8000").split(",") if url.strip()]
+GEN_Q_URLS = [url.strip() for url in os.environ.get("GEN_Q_URLS", "http://127.0.0.1:7888").split(",") if url.strip()]
+
+# SECONDS BETWEEN HEALTH PROBES OF THE LLM BACKENDS
+LLM_HEALTH_CHECK_SEC = float(os.environ.get("LLM_HEALTH_CHECK_SEC", 10))
+
+# CONSECUTIVE FAILED REQUESTS AFTER WHICH AN LLM BACKEND IS TAKEN OUT OF ROTATION, AND FOR HOW MANY SECONDS
+LLM_MAX_FAILURES = int(os.environ.get("LLM_MAX_FAILURES", 3))
+LLM_EJECT_SEC = float(os.environ.get("LLM_EJECT_SEC", 30))
+
+# 1 TO STREAM GENERATED QUESTIONS, STOPPING AS SOON AS THE JSON IS COMPLETE AND SHOWING PROGRESS ON THE TOPIC CARD
+GEN_Q_STREAM = int(os.environ.get("GEN_Q_STREAM", 1))
+
 HF_CLIENT_ID = os.environ.get("HF_CLIENT_ID")
 HF_CLIENT_SECRET = os.environ.get("HF_CLIENT_SECRET")
 HF_REDIRECT_URI = os.environ.get("HF_REDIRECT_URI")
@@ -37,4 +86,34 @@ GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.environ.get("GOOGLE_CLIENT_SECRET")
 GOOGLE_REDIRECT_URI = os.environ.get("GOOGLE_REDIRECT_URI")
 
-DB_DIRECTORY = os.environ.get("DB_DIRECTORY", "")
\ No newline at end of file
+# COMMA SEPARATED USERS (AS SHOWN IN THE GAME, ex: name#1234) ALLOWED TO SEE THE /admin PAGES
+ADMIN_USERS = [user.strip() for user in os.environ.get("ADMIN_USERS", "").split(",") if user.strip()]
+
+# LOGGING LEVEL (DEBUG, INFO, WARNING...). DEBUG LOGS THE FULL LLM PROMPTS AND RESPONSES.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# SECONDS BETWEEN TWO EVENT LOOP LAG MEASUREMENTS
+LOOP_LAG_PROBE_SEC = float(os.environ.get("LOOP_LAG_PROBE_SEC", 0.5))
+
+# AN EVENT LOOP BLOCKED FOR MORE THAN THIS MANY SECONDS GETS ITS STACK LOGGED AND LISTED ON /admin/slow_callbacks
+SLOW_CALLBACK_SEC = float(os.environ.get("SLOW_CALLBACK_SEC", 0.5))
+
+DB_DIRECTORY = os.environ.get("DB_DIRECTORY", "")
+
+# NUMBER OF SQLITE CONNECTIONS (EACH ON ITS OWN WORKER THREAD) USED BY THE REQUEST HANDLERS AND THE GAME LOOP
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 4))
+
+# HOW OFTEN (IN SECONDS) THE IN-MEMORY POINTS BALANCES ARE WRITTEN TO THE DATABASE. A CRASH LOSES AT MOST THIS MUCH SCORING.
+LEDGER_FLUSH_SEC = float(os.environ.get("LEDGER_FLUSH_SEC", 5))
+
+# "local" RUNS THE GAME IN THIS PROCESS. "sqlite" LETS SEVERAL WORKERS (ex: uvicorn --workers N) SHARE ONE GAME THROUGH THE DATABASE.
+GAME_BROKER = os.environ.get("GAME_BROKER", "local")
+
+# WITH GAME_BROKER=sqlite: HOW OFTEN EACH WORKER CHECKS FOR NEW EVENTS AND COMMANDS
+BROKER_POLL_SEC = float(os.environ.get("BROKER_POLL_SEC", 0.1))
+
+# WITH GAME_BROKER=sqlite: SECONDS WITHOUT RENEWAL AFTER WHICH ANOTHER WORKER TAKES OVER THE GAME
+BROKER_LEASE_SEC = float(os.environ.get("BROKER_LEASE_SEC", 10))
+
+# LOCAL .parquet OR .jsonl FILE TO IMPORT THE TRIVIA DATASET FROM ON FIRST BOOT. WHEN EMPTY, IT'S DOWNLOADED FROM THE HF HUB.
+TRIVIA_DATASET_PATH = os.environ.get("TRIVIA_DATASET_PATH", "")
\ No newline at end of file
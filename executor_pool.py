@@ -0,0 +1,96 @@
+import asyncio
+import itertools
+import logging
+import math
+import time
+
+# SECONDS BETWEEN TWO RESIZES OF THE POOL
+RESIZE_INTERVAL_SEC = 1
+# WEIGHT OF THE LAST INTERVAL IN THE AVERAGE THROUGHPUT AND LATENCY
+EWMA_WEIGHT = 0.3
+
+
+class ExecutorPool:
+    """Executors taking items off `queue` and running `handle(item)`, between `min_workers` and `max_workers` of them.
+
+    The pool is sized for the larger of the backlog (queued and in-progress items) and the concurrency the
+    recent throughput and time per item call for (Little's law), capped by `slots()`, the backend slots
+    currently in rotation: more executors than slots would only wait on the backends.
+    It grows right away and shrinks by one idle executor per resize, so a gap between two bids doesn't drop it."""
+
+    def __init__(self, queue, handle, min_workers, max_workers, slots):
+        self.queue = queue
+        self.handle = handle
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.slots = slots
+        self.workers = {}  # executor id -> task
+        self.busy = set()  # ids of the executors handling an item
+        self.ids = itertools.count()
+        self.done = 0  # items handled since the last resize
+        self.busy_sec = 0.0  # time spent on them
+        self.throughput = 0.0  # items per second
+        self.latency = 0.0  # seconds per item
+
+    @property
+    def backlog(self):
+        return self.queue.qsize() + len(self.busy)
+
+    def target(self):
+        needed = max(self.backlog, math.ceil(self.throughput * self.latency))
+        limit = max(self.min_workers, min(self.max_workers, self.slots()))
+        return max(self.min_workers, min(limit, needed))
+
+    async def run(self):
+        try:
+            last = time.monotonic()
+            self.resize()
+            while True:
+                await asyncio.sleep(RESIZE_INTERVAL_SEC)
+                now = time.monotonic()
+                self.observe(now - last)
+                last = now
+                self.resize()
+        finally:
+            for task in self.workers.values():
+                task.cancel()
+            self.workers = {}
+            self.busy = set()
+
+    def observe(self, elapsed):
+        self.throughput += EWMA_WEIGHT * (self.done / elapsed - self.throughput)
+        if self.done:
+            self.latency += EWMA_WEIGHT * (self.busy_sec / self.done - self.latency)
+        self.done, self.busy_sec = 0, 0.0
+
+    def grow(self):
+        "Starts executors up to the target right away, ex: for a burst of queued items"
+        target = self.target()
+        while len(self.workers) < target:
+            executor_id = next(self.ids)
+            self.workers[executor_id] = asyncio.create_task(self.run_executor(executor_id))
+        return target
+
+    def resize(self):
+        target = self.grow()
+        idle = [executor_id for executor_id in self.workers if executor_id not in self.busy]
+        if len(self.workers) > target and idle:
+            self.workers.pop(idle[-1]).cancel()
+        if len(self.workers) != target:
+            logging.debug(f"Executors: {len(self.workers)}, target {target}, backlog {self.backlog}, "
+                          f"{self.throughput:.2f} items/s, {self.latency:.2f}s per item")
+
+    async def run_executor(self, executor_id):
+        while True:
+            item = await self.queue.get()
+            self.busy.add(executor_id)
+            start = time.monotonic()
+            try:
+                await self.handle(item)
+            except Exception as e:
+                logging.debug(f"Executor {executor_id} failed: {e}")
+            finally:
+                self.busy.discard(executor_id)
+                self.done += 1
+                self.busy_sec += time.monotonic() - start
+                self.queue.task_done()
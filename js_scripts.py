@@ -109,3 +109,20 @@ def enterToBid():
         });
         """
     return Script(src)
+
+def clientCountdown():
+    src = """
+        let countdownOffset = 0;
+        setInterval(function() {
+            const el = document.getElementById('countdown');
+            if (!el || !el.dataset.deadline) return;
+            if (el.dataset.serverNow) {
+                countdownOffset = Date.now() - Number(el.dataset.serverNow);
+                delete el.dataset.serverNow;
+            }
+            const left = Math.max(0, Math.ceil((Number(el.dataset.deadline) + countdownOffset - Date.now()) / 1000));
+            el.textContent = left >= 10 ? left : '0' + left;
+            el.style.color = left <= 5 ? 'red' : '';
+        }, 250);
+        """
+    return Script(src)
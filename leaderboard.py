@@ -0,0 +1,47 @@
+from bisect import bisect_left, insort
+
+
+class Leaderboard:
+    """Every player ordered by points, kept up to date from the points ledger.
+
+    Rank lookups are a bisect, and the rendered top of the table is cached until a change reaches it."""
+
+    def __init__(self, top_k):
+        self.top_k = top_k
+        self.ranking = []  # sorted (-points, player id)
+        self.points = {}  # player id -> points
+        self.names = {}  # player id -> name
+        self.fragment = None  # rendered top_k table, None when stale
+
+    def load(self, rows):
+        self.names = {row['id']: row['name'] for row in rows}
+        self.points = {row['id']: row['points'] for row in rows}
+        self.ranking = sorted((-points, player_id) for player_id, points in self.points.items())
+        self.fragment = None
+
+    def add_player(self, player_id, name, points):
+        self.names[player_id] = name
+        self.update(player_id, points)
+
+    def update(self, player_id, points):
+        old_points = self.points.get(player_id)
+        if old_points == points:
+            return
+        old_pos = len(self.ranking)
+        if old_points is not None:
+            old_pos = bisect_left(self.ranking, (-old_points, player_id))
+            del self.ranking[old_pos]
+        insort(self.ranking, (-points, player_id))
+        self.points[player_id] = points
+        if min(old_pos, bisect_left(self.ranking, (-points, player_id))) < self.top_k:
+            self.fragment = None
+
+    def rank(self, player_id):
+        "1-based rank, players with the same points share it"
+        points = self.points.get(player_id)
+        if points is None:
+            return None
+        return bisect_left(self.ranking, (-points,)) + 1
+
+    def top(self):
+        return [(self.names[player_id], -neg_points) for neg_points, player_id in self.ranking[:self.top_k]]
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+
+
+class PointsLedger:
+    """In-memory points balances, written behind to the players table in periodic batches.
+
+    The ledger is the only writer of players.points. Debits check and update without an await in between, so
+    concurrent bids can't overdraw. A flush writes absolute balances in one transaction, so a crash loses at most
+    the changes since the last flush and never leaves a batch half applied; a failed flush stays dirty for the next one."""
+
+    def __init__(self, adb, on_change=None):
+        self.adb = adb
+        self.on_change = on_change  # called with (player id, new balance)
+        self.balances = {}  # player id -> points
+        self.dirty = set()
+        self._flush_lock = asyncio.Lock()
+
+    async def _load(self, player_ids):
+        missing = [player_id for player_id in player_ids if player_id not in self.balances]
+        if missing:
+            rows = await self.adb.fetchall(f"SELECT id, points FROM players WHERE id IN ({', '.join('?' * len(missing))})", missing)
+            for row in rows:
+                # another coroutine may have loaded (and changed) the balance while we were waiting
+                self.balances.setdefault(row['id'], row['points'])
+
+    def add_player(self, player_id, points):
+        "Registers a freshly inserted player row"
+        self.balances.setdefault(player_id, points)
+
+    async def balance(self, player_id):
+        await self._load([player_id])
+        return self.balances.get(player_id)
+
+    async def debit(self, player_id, points):
+        "Returns the new balance, or None (and changes nothing) if the player doesn't have enough points"
+        await self._load([player_id])
+        current = self.balances.get(player_id)
+        if current is None or current < points:
+            return None
+        self.balances[player_id] = current - points
+        self._changed(player_id)
+        return self.balances[player_id]
+
+    async def credit(self, awards):
+        "Applies (points, player id) awards and returns the new balances by player id"
+        await self._load([player_id for _, player_id in awards])
+        for points, player_id in awards:
+            if player_id in self.balances:
+                self.balances[player_id] += points
+                self._changed(player_id)
+        return {player_id: self.balances[player_id] for _, player_id in awards if player_id in self.balances}
+
+    def _changed(self, player_id):
+        self.dirty.add(player_id)
+        if self.on_change:
+            self.on_change(player_id, self.balances[player_id])
+
+    async def flush(self):
+        "Writes the dirty balances to the players table and returns how many rows were written"
+        async with self._flush_lock:
+            if not self.dirty:
+                return 0
+            batch = [(self.balances[player_id], player_id) for player_id in self.dirty]
+            self.dirty = set()
+            try:
+                await self.adb.executemany("UPDATE players SET points = ? WHERE id = ?", batch)
+            except BaseException:
+                self.dirty.update(player_id for _, player_id in batch)
+                raise
+            return len(batch)
+
+    async def run(self, interval_sec):
+        while True:
+            await asyncio.sleep(interval_sec)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Points flush failed, will retry: {e}")
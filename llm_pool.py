@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+import httpx
+import metrics
+
+
+class Backend:
+    "One llama-server endpoint"
+
+    def __init__(self, url, slots):
+        self.url = url.rstrip("/")
+        self.slots = slots
+        self.outstanding = 0
+        self.failures = 0  # consecutive
+        self.ejected_until = 0
+        self.last_used = 0
+
+
+class BackendPool:
+    """The llama-servers serving one role (moderation or generation).
+
+    Each request goes to the healthy backend with the fewest outstanding requests and waits while all of them are busy.
+    A backend failing `max_failures` requests in a row, or its health probe, is left out for `eject_sec`
+    or until a probe finds it healthy again."""
+
+    def __init__(self, name, urls, slots_per_backend, max_failures, eject_sec):
+        self.name = name
+        self.backends = [Backend(url, slots_per_backend) for url in urls]
+        self.max_failures = max_failures
+        self.eject_sec = eject_sec
+        self.changed = asyncio.Condition()
+
+    @property
+    def total_slots(self):
+        return sum(backend.slots for backend in self.backends)
+
+    @property
+    def available_slots(self):
+        "Slots of the backends currently in rotation"
+        now = time.monotonic()
+        return sum(backend.slots for backend in self.backends if backend.ejected_until <= now)
+
+    @asynccontextmanager
+    async def slot(self):
+        "Yields the backend to send one request to; an exception raised inside counts as a failure of that backend"
+        queued = time.monotonic()
+        backend = await self._acquire()
+        start = time.monotonic()
+        metrics.observe("trivia_llm_queue_wait_seconds", start - queued, pool=self.name)
+        try:
+            yield backend
+        except asyncio.CancelledError:
+            await self._release(backend, None)
+            raise
+        except Exception:
+            metrics.inc("trivia_llm_request_errors_total", pool=self.name, backend=backend.url)
+            await self._release(backend, False)
+            raise
+        metrics.observe("trivia_llm_request_seconds", time.monotonic() - start, pool=self.name, backend=backend.url)
+        await self._release(backend, True)
+
+    async def _acquire(self):
+        async with self.changed:
+            while True:
+                now = time.monotonic()
+                candidates = [b for b in self.backends if b.ejected_until <= now and b.outstanding < b.slots]
+                if candidates:
+                    backend = min(candidates, key=lambda b: (b.outstanding, b.last_used))
+                    backend.outstanding += 1
+                    backend.last_used = now
+                    return backend
+                readmissions = [b.ejected_until for b in self.backends if b.ejected_until > now]
+                try:
+                    await asyncio.wait_for(self.changed.wait(), min(readmissions) - now if readmissions else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release(self, backend, ok):
+        async with self.changed:
+            backend.outstanding -= 1
+            if ok:
+                backend.failures = 0
+            elif ok is False:
+                backend.failures += 1
+                if backend.failures >= self.max_failures:
+                    self._eject(backend, f"{backend.failures} failed requests in a row")
+            self.changed.notify_all()
+
+    def _eject(self, backend, reason):
+        if backend.ejected_until <= time.monotonic():
+            logging.warning(f"Ejecting {self.name} backend {backend.url} for {self.eject_sec}s: {reason}")
+        backend.ejected_until = time.monotonic() + self.eject_sec
+
+    async def probe(self, client):
+        "Checks every backend's /health endpoint, ejecting the failing ones and readmitting the recovered ones"
+        for backend in self.backends:
+            try:
+                response = await client.get(f"{backend.url}/health", timeout=5)
+                healthy = response.status_code == 200
+            except httpx.HTTPError:
+                healthy = False
+            async with self.changed:
+                if not healthy:
+                    self._eject(backend, "health probe failed")
+                elif backend.ejected_until > time.monotonic():
+                    logging.info(f"Readmitting {self.name} backend {backend.url}")
+                    backend.ejected_until = 0
+                    backend.failures = 0
+                    self.changed.notify_all()
@@ -1,6 +1,11 @@
+import asyncio
 import json
 import httpx
 import logging
+import time
+import env_vars
+import metrics
+from llm_pool import BackendPool
 
 timeout = httpx.Timeout(300.0)
 
@@ -63,12 +68,119 @@ Follow this JSON schema when providing the answer:
 {QUESTION_JSON_SCHEMA}
 """)
 
-TOPIC_CHECK_URL = "http://127.0.0.1:8000/completion"
-GEN_Q_URL =  "http://127.0.0.1:7888/completion"
 headers = {
     "Content-Type": "application/json"
 }
 
+# one pooled keep-alive client for the whole app, see startup()/shutdown()
+client = None
+health_check_task = None
+
+# requests above the llama-server --parallel slots wait in the pools instead of piling up on the servers
+topic_check_pool = BackendPool("topic check", env_vars.TOPIC_CHECK_URLS, env_vars.TOPIC_CHECK_PARALLEL, env_vars.LLM_MAX_FAILURES, env_vars.LLM_EJECT_SEC)
+gen_q_pool = BackendPool("question generation", env_vars.GEN_Q_URLS, env_vars.GEN_Q_PARALLEL, env_vars.LLM_MAX_FAILURES, env_vars.LLM_EJECT_SEC)
+
+async def startup():
+    global client, health_check_task
+    pools = [topic_check_pool, gen_q_pool]
+    # one extra connection per backend for the health probes
+    nr_connections = sum(pool.total_slots + len(pool.backends) for pool in pools)
+    limits = httpx.Limits(max_connections=nr_connections, max_keepalive_connections=nr_connections)
+    client = httpx.AsyncClient(headers=headers, timeout=timeout, limits=limits)
+    health_check_task = asyncio.create_task(_check_health(pools))
+
+async def shutdown():
+    global client, health_check_task
+    if health_check_task:
+        health_check_task.cancel()
+        health_check_task = None
+    if client:
+        await client.aclose()
+        client = None
+
+async def _check_health(pools):
+    while True:
+        await asyncio.sleep(env_vars.LLM_HEALTH_CHECK_SEC)
+        for pool in pools:
+            await pool.probe(client)
+
+async def _complete(pool, data):
+    "Runs a completion on the least busy healthy backend of `pool` and returns the generated text"
+    async with pool.slot() as backend:
+        response = await client.post(f"{backend.url}/completion", json=data)
+        response.raise_for_status()
+        content = response.json()["content"]
+        logging.debug("LLM response: %s", content)
+        return content
+
+async def _stream_json_completion(pool, data, nr_values, on_progress=None):
+    """Streams a completion and returns the generated JSON object as soon as it closes, stopping the generation there.
+
+    `on_progress(fraction of values complete)` is awaited at the first token and whenever another value is complete."""
+    scanner = _ObjectScanner(nr_values)
+    first_token_sec = None
+    progress = None
+    async with pool.slot() as backend:
+        start = time.monotonic()  # the wait for the slot is in trivia_llm_queue_wait_seconds
+        # leaving the block early closes the connection, which makes llama-server free the slot
+        async with client.stream("POST", f"{backend.url}/completion", json={**data, "stream": True}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                chunk = json.loads(line[len("data: "):])
+                if first_token_sec is None:
+                    first_token_sec = time.monotonic() - start
+                    metrics.observe("trivia_llm_first_token_seconds", first_token_sec, pool=pool.name, backend=backend.url)
+                if scanner.feed(chunk.get("content", "")) or chunk.get("stop"):
+                    break
+                if on_progress and scanner.progress != progress:
+                    progress = scanner.progress
+                    await on_progress(progress)
+    logging.info(f"Streamed completion: first token after {first_token_sec or 0:.2f}s, done after {time.monotonic() - start:.2f}s")
+    return scanner.text
+
+class _ObjectScanner:
+    "Follows a streamed JSON object just enough to tell how many of its values are complete and where it ends"
+
+    def __init__(self, nr_values):
+        self.nr_values = nr_values
+        self.text = ""
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.top_level_strings = 0  # keys and values of the outer object
+        self.done = False
+
+    @property
+    def progress(self):
+        return min(1.0, self.top_level_strings // 2 / self.nr_values)
+
+    def feed(self, chunk):
+        "Returns True once the outer object closed; anything generated after it is dropped"
+        for i, ch in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.top_level_strings += 1
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.text += chunk[:i + 1]
+                    self.done = True
+                    return True
+        self.text += chunk
+        return False
+
 def _add_special_tokens(raw_prompt):
     return f"""<start_of_turn>user\n{raw_prompt}<end_of_turn>\n<start_of_turn>model\n"""
  
@@ -77,30 +189,28 @@ async def topic_check(topic):
         data_q_check = {
             "temperature": 0,
             "prompt": _question_check_prompt(topic),
-            "grammar": """root ::= ("Yes" | "No")"""
+            "grammar": """root ::= ("Yes" | "No")""",
+            # reuses the evaluated prompt prefix cached in the llama-server slot
+            "cache_prompt": True
         }
-        async with httpx.AsyncClient() as client:
-            logging.debug(f"topic_check: {data_q_check}")
-            response = await client.post(TOPIC_CHECK_URL, headers=headers, json=data_q_check, timeout=timeout)
-            logging.debug(response.json())
-            content = response.json()["content"]
-        return content
-    except:
+        logging.debug("topic_check: %s", data_q_check)
+        return await _complete(topic_check_pool, data_q_check)
+    except Exception:
         return None
 
-async def generate_question(topic):
+async def generate_question(topic, on_progress=None):
     try:
         data_gen_q = {
             "n_predict": 2500,
             "prompt": _add_special_tokens(QUESTION_PROMPT + topic),
             "json_schema": QUESTION_JSON_SCHEMA
         }
-        async with httpx.AsyncClient() as client:
-            logging.debug(f"generate_question: {data_gen_q}")
-            response = await client.post(GEN_Q_URL, headers=headers, json=data_gen_q, timeout=timeout)
-            logging.debug(response.json())
-            content = response.json()["content"]
+        logging.debug("generate_question: %s", data_gen_q)
+        if env_vars.GEN_Q_STREAM:
+            content = await _stream_json_completion(gen_q_pool, data_gen_q, len(QUESTION_JSON_SCHEMA["required"]), on_progress)
+        else:
+            content = await _complete(gen_q_pool, data_gen_q)
         return json.loads(content)
-    except:
+    except Exception:
         return None
     
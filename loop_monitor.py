@@ -0,0 +1,53 @@
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+import metrics
+
+# NUMBER OF SLOW CALLBACK REPORTS KEPT FOR /admin/slow_callbacks
+MAX_REPORTS = 20
+
+
+class LoopMonitor:
+    """Measures how late the event loop runs a timer, and reports what blocks it.
+
+    A probe task sleeps `interval` seconds at a time and records how late it wakes up. A watchdog thread
+    checks that the probe keeps ticking: once the loop is blocked for more than `stall_sec`, it captures the
+    stack of the event loop thread, so the report shows the code doing the blocking."""
+
+    def __init__(self, interval, stall_sec):
+        self.interval = interval
+        self.stall_sec = stall_sec
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id = None
+        self.reports = collections.deque(maxlen=MAX_REPORTS)
+
+    async def run(self):
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.heartbeat = time.monotonic()
+            metrics.observe("trivia_event_loop_lag_seconds", max(0.0, self.heartbeat - start - self.interval), metrics.FAST_BUCKETS)
+
+    def _watch(self):
+        reported = None  # heartbeat of the stall already reported
+        while True:
+            time.sleep(self.stall_sec / 2)
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked > self.stall_sec and heartbeat != reported:
+                reported = heartbeat
+                self._report(blocked)
+
+    def _report(self, blocked):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        metrics.inc("trivia_event_loop_stalls_total")
+        self.reports.append({"at": time.strftime("%Y-%m-%d %H:%M:%S"), "blocked_sec": round(blocked, 3), "stack": stack})
+        logging.warning(f"Event loop blocked for more than {blocked:.2f}s in:\n{stack}")
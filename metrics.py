@@ -0,0 +1,120 @@
+import bisect
+import threading
+
+# UPPER BOUNDS (SECONDS) OF THE HISTOGRAM BUCKETS, THE LAST BUCKET TAKES EVERYTHING ABOVE
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+# NAME -> (TYPE, HELP) OF EVERY METRIC SHOWN ON /metrics
+METRICS = {
+    "trivia_ws_sockets": ("gauge", "WebSocket clients connected to this worker"),
+    "trivia_ws_users": ("gauge", "Distinct users connected to this worker"),
+    "trivia_broadcast_seconds": ("histogram", "Time from publishing a message until its send to the last recipient completed"),
+    "trivia_ws_send_failures_total": ("counter", "Clients dropped because a send failed or their send queue was full"),
+    "trivia_topics": ("gauge", "Topics in the list, by status"),
+    "trivia_queue_depth": ("gauge", "Topics waiting for a pipeline stage, by queue"),
+    "trivia_executors": ("gauge", "Question generation executors running"),
+    "trivia_llm_request_seconds": ("histogram", "Duration of the completed LLM requests, by pool and backend"),
+    "trivia_llm_first_token_seconds": ("histogram", "Time from getting a backend slot until the first streamed token of an LLM request, by pool and backend"),
+    "trivia_llm_queue_wait_seconds": ("histogram", "Time an LLM request waited for a free backend slot, by pool"),
+    "trivia_llm_request_errors_total": ("counter", "Failed LLM requests, by pool and backend"),
+    "trivia_sqlite_query_seconds": ("histogram", "Time spent running a query or transaction on a SQLite connection"),
+    "trivia_event_loop_lag_seconds": ("histogram", "How late the event loop lag probe woke up"),
+    "trivia_event_loop_stalls_total": ("counter", "Times the event loop was blocked longer than SLOW_CALLBACK_SEC"),
+}
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        "Upper bound of the bucket holding the q-th quantile, None above the last bound"
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def summary(self):
+        return {"count": self.count, "sum": round(self.sum, 3),
+                "mean": round(self.sum / self.count, 3) if self.count else None,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99),
+                "buckets": {str(bound): count for bound, count in zip(self.buckets + ("+Inf",), self.counts)}}
+
+
+class Registry:
+    """Counters and histograms updated where things happen, and gauges read from the game state when scraped.
+
+    Safe to update from the SQLite worker threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.gauges = {}  # name -> function returning a value or a list of (labels dict, value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, buckets=BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def render(self):
+        "The metrics in the Prometheus text exposition format"
+        samples = {name: [] for name in METRICS}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                samples[name].append(_sample(name, labels, value))
+            for (name, labels), histogram in self.histograms.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    samples[name].append(_sample(f"{name}_bucket", labels + (("le", bound),), cumulative))
+                samples[name].append(_sample(f"{name}_sum", labels, histogram.sum))
+                samples[name].append(_sample(f"{name}_count", labels, histogram.count))
+        for name, read in self.gauges.items():
+            value = read()
+            for labels, v in value if isinstance(value, list) else [({}, value)]:
+                samples[name].append(_sample(name, tuple(sorted(labels.items())), v))
+        lines = []
+        for name, (typ, description) in METRICS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {typ}", *samples[name]]
+        return "\n".join(lines) + "\n"
+
+
+def _sample(name, labels, value):
+    if not labels:
+        return f"{name} {value}"
+    pairs = ",".join(f'{key}="{_escape(v)}"' for key, v in labels)
+    return f"{name}{{{pairs}}} {value}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+gauge = REGISTRY.gauge
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import re
+from difflib import SequenceMatcher
+import llm_req
+from topic_cache import normalize_topic
+
+ALLOWED_PUNCTUATION = set(" '&.,:!?()+#/-")
+PROMPT_INJECTIONS = ["ignore previous instructions"]
+
+
+def load_blocklist(path):
+    "One case insensitive regex per line, `#` starts a comment line; None without a file"
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as f:
+        patterns = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE) if patterns else None
+
+
+class Moderator:
+    """Topic moderation: cheap local checks first, then the LLM policy check (through the verdict cache).
+
+    Identical topics checked at the same time share one LLM request."""
+
+    def __init__(self, topic_cache, max_length, blocklist=None):
+        self.topic_cache = topic_cache
+        self.max_length = max_length
+        self.blocklist = blocklist
+        self.in_flight = {}  # normalized topic -> LLM check task
+
+    def prefilter(self, topic):
+        "Returns why the topic is rejected without asking the LLM, or None"
+        if not 0 < len(topic) <= self.max_length:
+            return "length"
+        if not all(ch.isalnum() or ch in ALLOWED_PUNCTUATION for ch in topic):
+            return "characters"
+        if not any(ch.isalpha() for ch in topic):
+            return "no letters"
+        if any(SequenceMatcher(None, topic.lower(), p).ratio() >= 0.5 for p in PROMPT_INJECTIONS):
+            return "prompt injection"
+        if self.blocklist and self.blocklist.search(topic):
+            return "blocklist"
+        return None
+
+    async def check(self, topic):
+        "Returns 'No' if the topic is allowed, 'Yes' if it violates the policy and anything else if the check failed"
+        reason = self.prefilter(topic)
+        if reason:
+            logging.info(f"Topic '{topic}' rejected before the LLM check: {reason}")
+            return "Yes"
+        key = normalize_topic(topic)
+        task = self.in_flight.get(key)
+        if task is None:
+            task = self.in_flight[key] = asyncio.create_task(self._llm_check(topic))
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # one waiter being cancelled must not cancel the check the others share
+        return await asyncio.shield(task)
+
+    async def _llm_check(self, topic):
+        verdict = await self.topic_cache.get_verdict(topic)
+        if verdict is None:
+            verdict = await llm_req.topic_check(topic)
+            if verdict in ["Yes", "No"]:
+                await self.topic_cache.put_verdict(topic, verdict)
+        return verdict
@@ -0,0 +1,38 @@
+import time
+from metrics import Histogram
+
+# STAGE -> (FROM TIMESTAMP, TO TIMESTAMP). A STAGE IS ONLY RECORDED WHEN THE TOPIC WENT THROUGH BOTH.
+STAGES = {
+    "moderation_wait": ("queued", "moderation_start"),
+    "moderation": ("moderation_start", "moderation_end"),
+    "generation_wait": ("moderation_end", "generation_start"),
+    "generation": ("generation_start", "generation_end"),
+    "ready_wait": ("generation_end", "promoted"),
+    "broadcast": ("promoted", "broadcast_end"),
+    "total": ("queued", "broadcast_end"),
+}
+
+
+def mark(timestamps, event):
+    "Records when the topic first reached `event`"
+    timestamps.setdefault(event, time.monotonic())
+
+
+class PipelineTrace:
+    """Latency histograms of the topic pipeline stages, per stage and topic source ("user", "bot" or "db").
+
+    Stages overlapping with a later one (ex: generation started speculatively before moderation ended) are skipped
+    where they would be negative."""
+
+    def __init__(self):
+        self.histograms = {}  # (stage, source) -> Histogram
+
+    def record(self, timestamps, source):
+        for stage, (start, end) in STAGES.items():
+            if start in timestamps and end in timestamps and timestamps[end] >= timestamps[start]:
+                self.histograms.setdefault((stage, source), Histogram()).observe(timestamps[end] - timestamps[start])
+
+    def summary(self, source=None):
+        order = list(STAGES)
+        keys = sorted(self.histograms, key=lambda key: (order.index(key[0]), key[1]))
+        return {f"{stage}/{src}": self.histograms[stage, src].summary() for stage, src in keys if source is None or src == source}
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from collections import deque
+import llm_req
+
+# SECONDS TO WAIT BEFORE RETRYING WHEN THE GENERATOR BACKEND FAILS
+RETRY_AFTER_FAILURE_SEC = 5
+
+
+class QuestionPregenerator:
+    "Keeps a buffer of LLM generated questions for bot picked topics, filled only while no user topic needs the generator"
+
+    def __init__(self, size, pick_topic, wait_idle):
+        self.size = size
+        self.pick_topic = pick_topic
+        self.wait_idle = wait_idle
+        self.buffer = deque()
+        self.current = None
+        self.yielded = False  # set when the in-flight pre-generation is cancelled for a user topic
+        self.space_freed = asyncio.Event()
+
+    def take(self, n):
+        "Pops up to `n` ready (topic, llm content) pairs"
+        ready = [self.buffer.popleft() for _ in range(min(n, len(self.buffer)))]
+        if ready:
+            self.space_freed.set()
+        return ready
+
+    def yield_to_users(self):
+        "Aborts the in-flight pre-generation so a user topic gets the generator slot"
+        if self.current and not self.current.done():
+            self.yielded = True
+            self.current.cancel()
+
+    async def run(self):
+        while True:
+            if len(self.buffer) >= self.size:
+                self.space_freed.clear()
+                await self.space_freed.wait()
+                continue
+            await self.wait_idle()
+            topic = await self.pick_topic()
+            if not topic:
+                await asyncio.sleep(RETRY_AFTER_FAILURE_SEC)
+                continue
+            self.yielded = False
+            self.current = asyncio.create_task(llm_req.generate_question(topic))
+            try:
+                content = await self.current
+            except asyncio.CancelledError:
+                if not self.yielded:
+                    raise
+                logging.debug(f"Pre-generation of '{topic}' yielded to a user topic")
+                continue
+            finally:
+                self.current = None
+            if content:
+                self.buffer.append((topic, content))
+                logging.debug(f"Pre-generated question for '{topic}', buffer size: {len(self.buffer)}")
+            else:
+                await asyncio.sleep(RETRY_AFTER_FAILURE_SEC)
@@ -0,0 +1,63 @@
+class Presence:
+    """Connected WebSocket clients, indexed both by user and by socket.
+
+    Sockets are keyed by their `ws` object, the one thing FastHTML passes unchanged to both on_connect and on_disconnect.
+    Every method runs on the event loop without awaiting, so no lock is needed and connect/disconnect are O(1)."""
+
+    def __init__(self):
+        self.sockets = {}  # ws -> (send, user id or None for anonymous clients)
+        self.by_send = {}  # send -> ws, for the broadcaster which only knows the send callable
+        self.user_sockets = {}  # user id -> {ws: send}, in connection order
+        self._all_sends = None
+        self._users = None
+
+    def connect(self, ws, send, user_id=None):
+        self.disconnect(ws)
+        self.sockets[ws] = (send, user_id)
+        self.by_send[send] = ws
+        if user_id is not None:
+            if user_id not in self.user_sockets:
+                self._users = None
+            self.user_sockets.setdefault(user_id, {})[ws] = send
+        self._all_sends = None
+
+    def disconnect(self, ws):
+        "Returns the send callable registered for `ws`, or None if it was already gone"
+        entry = self.sockets.pop(ws, None)
+        if entry is None:
+            return None
+        send, user_id = entry
+        self.by_send.pop(send, None)
+        if user_id is not None:
+            user_sockets = self.user_sockets[user_id]
+            del user_sockets[ws]
+            if not user_sockets:
+                del self.user_sockets[user_id]
+                self._users = None
+        self._all_sends = None
+        return send
+
+    def socket_of(self, send):
+        return self.by_send.get(send)
+
+    def sends_of(self, user_id):
+        user_sockets = self.user_sockets.get(user_id)
+        return list(user_sockets.values()) if user_sockets else []
+
+    def all_sends(self):
+        "Snapshot of every client's send callable, rebuilt only after a connect or disconnect"
+        if self._all_sends is None:
+            self._all_sends = tuple(send for send, _ in self.sockets.values())
+        return self._all_sends
+
+    def users(self):
+        "Snapshot of the signed-in users that have at least one open socket"
+        if self._users is None:
+            self._users = tuple(self.user_sockets)
+        return self._users
+
+    def __contains__(self, user_id):
+        return user_id in self.user_sockets
+
+    def __len__(self):
+        return len(self.sockets)
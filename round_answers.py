@@ -0,0 +1,41 @@
+import time
+from collections import Counter
+
+
+class RoundAnswers:
+    """The answers given to one question, with the time each one was submitted.
+
+    Submitting and freezing never await, so they are atomic on the event loop and need no lock."""
+
+    def __init__(self):
+        self.answers = {}  # session id -> (option, server timestamp), in arrival order
+        self.counts = Counter()  # option -> number of answers
+        self.frozen = False
+
+    def submit(self, session_id, option, submitted_at=None):
+        "Only a player's first answer counts and nothing is accepted once the round is frozen; returns whether it was recorded"
+        if self.frozen or session_id in self.answers:
+            return False
+        self.answers[session_id] = (option, submitted_at if submitted_at is not None else time.time())
+        self.counts[option] += 1
+        return True
+
+    def option(self, session_id):
+        "The option the player answered, None if they didn't"
+        answer = self.answers.get(session_id)
+        return answer[0] if answer else None
+
+    def freeze(self):
+        self.frozen = True
+
+    def winners(self, correct_option):
+        "Sessions that answered `correct_option`, fastest first"
+        #answers relayed by other workers can arrive after faster ones, so they're ordered by submission time
+        correct = [(submitted_at, session_id) for session_id, (option, submitted_at) in self.answers.items() if option == correct_option]
+        return [session_id for _, session_id in sorted(correct, key=lambda answer: answer[0])]
+
+    def __len__(self):
+        return len(self.answers)
+
+    def __contains__(self, session_id):
+        return session_id in self.answers
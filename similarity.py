@@ -0,0 +1,100 @@
+import heapq
+import itertools
+import math
+import time
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from topic_cache import normalize_topic
+
+Q = 3  # n-gram size
+EPSILON = 1e-9  # float slack, so a ratio exactly at the threshold isn't filtered out
+
+
+def _grams(text):
+    padded = "\x02" * (Q - 1) + text + "\x03" * (Q - 1)
+    return Counter(padded[i:i + Q] for i in range(len(padded) - Q + 1))
+
+
+class TopicIndex:
+    """Character n-gram index of active, current and recently played topics.
+
+    `SequenceMatcher.ratio()` >= threshold implies the two strings share at least
+    `_min_shared` n-grams, so only candidates passing that count are verified with
+    the (expensive) `SequenceMatcher`."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.postings = defaultdict(dict)  # n-gram -> {key: count}
+        self.entries = {}  # key -> (normalized text, n-grams)
+        self.expiry = []  # heap of (expires_at, key)
+        self._keys = itertools.count()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, topic):
+        key = next(self._keys)
+        text = normalize_topic(topic)
+        grams = _grams(text)
+        self.entries[key] = (text, grams)
+        for gram, count in grams.items():
+            self.postings[gram][key] = count
+        return key
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for gram in entry[1]:
+            keys = self.postings[gram]
+            keys.pop(key, None)
+            if not keys:
+                del self.postings[gram]
+
+    def expire(self, key, after_sec):
+        "Keeps the topic indexed for `after_sec` more seconds (cooldown for played topics)"
+        if key in self.entries:
+            heapq.heappush(self.expiry, (time.monotonic() + after_sec, key))
+
+    def find(self, topic):
+        "Returns an indexed topic at least `threshold` similar to `topic`, or None"
+        self._purge()
+        text = normalize_topic(topic)
+        grams = _grams(text)
+        la = len(text)
+        if self._min_shared(la, self._max_len(la)) > 0:
+            shared = defaultdict(int)
+            for gram, count in grams.items():
+                for key, other_count in self.postings.get(gram, {}).items():
+                    shared[key] += min(count, other_count)
+            candidates = (key for key, nr in shared.items() if nr >= self._min_shared(la, len(self.entries[key][0])))
+        else:
+            candidates = list(self.entries)
+        for key in candidates:
+            other = self.entries[key][0]
+            if self._length_ok(la, len(other)) and SequenceMatcher(None, other, text).ratio() >= self.threshold:
+                return other
+        return None
+
+    def claim(self, topic):
+        "Atomically checks for a near-duplicate and indexes `topic` if there is none. Returns (key, match)"
+        match = self.find(topic)
+        if match is not None:
+            return None, match
+        return self.add(topic), None
+
+    def _purge(self):
+        now = time.monotonic()
+        while self.expiry and self.expiry[0][0] <= now:
+            self.remove(heapq.heappop(self.expiry)[1])
+
+    def _length_ok(self, la, lb):
+        return la + lb == 0 or 2 * min(la, lb) / (la + lb) >= self.threshold - EPSILON
+
+    def _max_len(self, la):
+        return math.floor(la * (2 - self.threshold) / self.threshold + EPSILON) if self.threshold > 0 else float("inf")
+
+    def _min_shared(self, la, lb):
+        # every unmatched character (in either string) breaks at most Q of the query's n-grams
+        max_unmatched = math.floor((1 - self.threshold) * (la + lb) + EPSILON)
+        return (la + Q - 1) - Q * max_unmatched
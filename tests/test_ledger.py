@@ -0,0 +1,67 @@
+import asyncio
+import sqlite3
+import pytest
+from db_pool import AsyncDB
+from ledger import PointsLedger
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "trivia.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE players (id INTEGER PRIMARY KEY, name TEXT, points INTEGER)")
+        conn.executemany("INSERT INTO players (id, name, points) VALUES (?, ?, ?)", [(1, "u1", 10), (2, "u2", 20)])
+    return path
+
+
+def stored_points(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return dict(conn.execute("SELECT id, points FROM players"))
+
+
+def test_failed_flush_keeps_entries_dirty(db_path):
+    async def scenario():
+        adb = AsyncDB(db_path, 2)
+        ledger = PointsLedger(adb)
+        await ledger.credit([(5, 1), (7, 2)])
+        await adb.execute("ALTER TABLE players RENAME TO players_away")
+        with pytest.raises(sqlite3.OperationalError):
+            await ledger.flush()
+        assert ledger.dirty == {1, 2}
+        await adb.execute("ALTER TABLE players_away RENAME TO players")
+        assert await ledger.flush() == 2
+        assert ledger.dirty == set()
+        adb.close()
+
+    asyncio.run(scenario())
+    assert stored_points(db_path) == {1: 15, 2: 27}
+
+
+def test_concurrent_debits_cannot_overdraw(db_path):
+    async def scenario():
+        adb = AsyncDB(db_path, 4)
+        ledger = PointsLedger(adb)
+        # the balance isn't loaded yet, so every debit awaits the database before checking it
+        results = await asyncio.gather(*[ledger.debit(1, 3) for _ in range(5)])
+        await ledger.flush()
+        adb.close()
+        return results
+
+    results = asyncio.run(scenario())
+    assert sorted(results, key=lambda r: (r is None, -(r or 0))) == [7, 4, 1, None, None]
+    assert stored_points(db_path)[1] == 1
+
+
+def test_crash_loses_only_changes_after_the_last_flush(db_path):
+    async def scenario():
+        adb = AsyncDB(db_path, 2)
+        ledger = PointsLedger(adb)
+        await ledger.credit([(5, 1)])
+        await ledger.debit(2, 4)
+        await ledger.flush()
+        await ledger.credit([(100, 1), (100, 2)])
+        # crash: the process dies with these changes only in memory
+        adb.close()
+
+    asyncio.run(scenario())
+    assert stored_points(db_path) == {1: 15, 2: 16}
@@ -0,0 +1,34 @@
+import random
+from difflib import SequenceMatcher
+import pytest
+from similarity import TopicIndex
+from topic_cache import normalize_topic
+
+
+def brute_force_match(topics, query, threshold):
+    query = normalize_topic(query)
+    return any(SequenceMatcher(None, normalize_topic(topic), query).ratio() >= threshold for topic in topics)
+
+
+def random_topic(rng):
+    return "".join(rng.choice("abce ") for _ in range(rng.randint(1, 12)))
+
+
+def test_ratio_exactly_at_threshold_is_found():
+    index = TopicIndex(0.9)
+    index.add("aceeb cbe")
+    assert SequenceMatcher(None, "aceeb cbe", "abceeb cabe").ratio() == 0.9
+    assert index.find("abceeb cabe") == "aceeb cbe"
+
+
+@pytest.mark.parametrize("threshold", [0.5, 0.7, 0.8, 0.9, 1.0])
+def test_find_matches_brute_force(threshold):
+    rng = random.Random(threshold)
+    for _ in range(200):
+        topics = [random_topic(rng) for _ in range(rng.randint(1, 8))]
+        index = TopicIndex(threshold)
+        for topic in topics:
+            index.add(topic)
+        for _ in range(10):
+            query = random_topic(rng)
+            assert (index.find(query) is not None) == brute_force_match(topics, query, threshold), (topics, query)
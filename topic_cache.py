@@ -0,0 +1,86 @@
+import json
+import time
+
+
+def normalize_topic(topic):
+    return " ".join(topic.lower().split())
+
+
+class TopicCache:
+    "Moderation verdicts and a small pool of generated questions per topic, kept in SQLite with TTL and LRU eviction"
+
+    def __init__(self, adb, ttl_sec, max_topics, questions_per_topic):
+        self.adb = adb
+        self.ttl_sec = ttl_sec
+        self.max_topics = max_topics
+        self.questions_per_topic = questions_per_topic
+
+    async def create_tables(self):
+        await self.adb.run(lambda conn: conn.executescript('''
+        CREATE TABLE IF NOT EXISTS topic_verdicts (
+            topic_key TEXT PRIMARY KEY,
+            verdict TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS topic_questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic_key TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_topic_verdicts_last_used ON topic_verdicts (last_used);
+        CREATE INDEX IF NOT EXISTS idx_topic_questions_key ON topic_questions (topic_key, last_used);
+        '''))
+
+    async def get_verdict(self, topic):
+        return await self.adb.run(self._get_verdict, normalize_topic(topic), time.time())
+
+    async def put_verdict(self, topic, verdict):
+        await self.adb.run(self._put_verdict, normalize_topic(topic), verdict, time.time())
+
+    async def get_question(self, topic):
+        "A hit only once the topic's pool is full; the least recently served question is returned"
+        return await self.adb.run(self._get_question, normalize_topic(topic), time.time())
+
+    async def put_question(self, topic, content):
+        await self.adb.run(self._put_question, normalize_topic(topic), content, time.time())
+
+    def _get_verdict(self, conn, key, now):
+        row = conn.execute("SELECT verdict FROM topic_verdicts WHERE topic_key = ? AND created_at >= ?",
+                           (key, now - self.ttl_sec)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE topic_verdicts SET last_used = ? WHERE topic_key = ?", (now, key))
+        return row[0]
+
+    def _put_verdict(self, conn, key, verdict, now):
+        conn.execute("INSERT OR REPLACE INTO topic_verdicts (topic_key, verdict, created_at, last_used) VALUES (?, ?, ?, ?)",
+                     (key, verdict, now, now))
+        self._evict(conn, now)
+
+    def _get_question(self, conn, key, now):
+        rows = conn.execute("SELECT id, content FROM topic_questions WHERE topic_key = ? AND created_at >= ? ORDER BY last_used",
+                            (key, now - self.ttl_sec)).fetchall()
+        if len(rows) < self.questions_per_topic:
+            return None
+        question_id, content = rows[0]
+        conn.execute("UPDATE topic_questions SET last_used = ? WHERE id = ?", (now, question_id))
+        conn.execute("UPDATE topic_verdicts SET last_used = ? WHERE topic_key = ?", (now, key))
+        return json.loads(content)
+
+    def _put_question(self, conn, key, content, now):
+        conn.execute("INSERT INTO topic_questions (topic_key, content, created_at, last_used) VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(content), now, now))
+        conn.execute('''DELETE FROM topic_questions WHERE topic_key = ? AND id NOT IN
+                        (SELECT id FROM topic_questions WHERE topic_key = ? ORDER BY created_at DESC LIMIT ?)''',
+                     (key, key, self.questions_per_topic))
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM topic_verdicts WHERE created_at < ?", (now - self.ttl_sec,))
+        conn.execute("DELETE FROM topic_questions WHERE created_at < ?", (now - self.ttl_sec,))
+        conn.execute('''DELETE FROM topic_verdicts WHERE topic_key IN
+                        (SELECT topic_key FROM topic_verdicts ORDER BY last_used DESC LIMIT -1 OFFSET ?)''',
+                     (self.max_topics,))
+        conn.execute("DELETE FROM topic_questions WHERE topic_key NOT IN (SELECT topic_key FROM topic_verdicts)")
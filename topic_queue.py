@@ -0,0 +1,81 @@
+import heapq
+import itertools
+
+# heap entry layout: [-points, insertion seq, topic, is_live]
+_TOPIC, _LIVE = 2, 3
+
+
+class TopicQueue:
+    "Topic backlog ordered by bid (highest first) and FIFO among equal bids"
+
+    def __init__(self):
+        self._heap = []
+        self._successful = []
+        self._seq = itertools.count()
+        self._len = 0
+        self._top = None
+        self._top_n = 0
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, topic):
+        return topic.handle is not None and topic.handle[_LIVE]
+
+    def __iter__(self):
+        return (entry[_TOPIC] for entry in sorted(e for e in self._heap if e[_LIVE]))
+
+    def push(self, topic):
+        "O(log n) insert. The returned handle is also stored on `topic.handle`"
+        entry = [-topic.points, next(self._seq), topic, True]
+        topic.handle = entry
+        heapq.heappush(self._heap, entry)
+        if topic.status == "successful":
+            heapq.heappush(self._successful, entry)
+        self._len += 1
+        self._invalidate_top(entry)
+        return entry
+
+    def remove(self, topic):
+        "Removes the topic by its handle; dead heap entries are skipped lazily"
+        entry = topic.handle
+        if entry is None or not entry[_LIVE]:
+            return False
+        entry[_LIVE] = False
+        topic.handle = None
+        self._len -= 1
+        self._invalidate_top(entry)
+        self._compact()
+        return True
+
+    def mark_successful(self, topic):
+        "Must be called once a queued topic reaches the successful status"
+        if topic in self:
+            heapq.heappush(self._successful, topic.handle)
+
+    def best_successful(self):
+        "The highest bid successful topic, or None"
+        heap = self._successful
+        while heap and not (heap[0][_LIVE] and heap[0][_TOPIC].status == "successful"):
+            heapq.heappop(heap)
+        return heap[0][_TOPIC] if heap else None
+
+    def top(self, n):
+        "The first `n` topics in queue order, cached until a change can affect them"
+        if self._top is None or self._top_n != n:
+            self._top = heapq.nsmallest(n, (e for e in self._heap if e[_LIVE]))
+            self._top_n = n
+        return [entry[_TOPIC] for entry in self._top]
+
+    def _invalidate_top(self, entry):
+        if self._top is not None and (len(self._top) < self._top_n or entry <= self._top[-1]):
+            self._top = None
+
+    def _compact(self):
+        while self._heap and not self._heap[0][_LIVE]:
+            heapq.heappop(self._heap)
+        if len(self._heap) > 2 * self._len + 16:
+            self._heap = [e for e in self._heap if e[_LIVE]]
+            heapq.heapify(self._heap)
+            self._successful = [e for e in self._successful if e[_LIVE]]
+            heapq.heapify(self._successful)
@@ -0,0 +1,91 @@
+import json
+import logging
+import sqlite3
+import time
+
+HF_DATASET = 'Mihaiii/trivia_single_choice-4-options'
+COLUMNS = ["topic", "question", "option_A", "option_B", "option_C", "option_D", "correct_option"]
+BATCH_SIZE = 10000
+# TABLE FILLED BY THE IMPORT, RENAMED TO trivias ONCE COMPLETE
+STAGING_TABLE = 'trivias_import'
+
+
+def _parquet_batches(path):
+    import pyarrow.parquet as pq
+    parquet_file = pq.ParquetFile(path)
+    total = parquet_file.metadata.num_rows
+    for batch in parquet_file.iter_batches(batch_size=BATCH_SIZE, columns=COLUMNS):
+        yield total, list(zip(*[batch.column(c).to_pylist() for c in COLUMNS]))
+
+
+def _jsonl_batches(path):
+    batch = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                batch.append(tuple(record[c] for c in COLUMNS))
+                if len(batch) == BATCH_SIZE:
+                    yield None, batch
+                    batch = []
+    if batch:
+        yield None, batch
+
+
+def _hub_batches():
+    from datasets import load_dataset
+    dataset = load_dataset(HF_DATASET, split='train')
+    for batch in dataset.iter(batch_size=BATCH_SIZE):
+        yield len(dataset), list(zip(*[batch[c] for c in COLUMNS]))
+
+
+def _batches(source):
+    if not source:
+        return _hub_batches()
+    if source.endswith(".parquet"):
+        return _parquet_batches(source)
+    if source.endswith(".jsonl"):
+        return _jsonl_batches(source)
+    raise ValueError(f"Unsupported trivia dataset file: {source} (expected .parquet or .jsonl)")
+
+
+def import_trivias(db_path, source=None):
+    """Fills a staging table one batch per transaction, then renames it to trivias, so an interrupted import leaves no trivias table behind.
+
+    The write lock is only held while a batch is inserted, never while the dataset is downloaded or read.
+    `source` is a local .parquet/.jsonl file for offline installs; without it the dataset is streamed from the HF hub."""
+    start = time.monotonic()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        conn.execute(f'''
+        CREATE TABLE {STAGING_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            question TEXT NOT NULL,
+            option_A TEXT NOT NULL,
+            option_B TEXT NOT NULL,
+            option_C TEXT NOT NULL,
+            option_D TEXT NOT NULL,
+            correct_option TEXT NOT NULL
+        );
+        ''')
+        insert_query = f"INSERT INTO {STAGING_TABLE} (topic, question, option_A, option_B, option_C, option_D, correct_option) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        count = 0
+        for total, batch in _batches(source):
+            conn.execute("BEGIN")
+            conn.executemany(insert_query, batch)
+            conn.execute("COMMIT")
+            count += len(batch)
+            progress = f"{count}/{total}" if total else str(count)
+            logging.info(f"Imported {progress} trivia rows")
+        conn.execute(f"ALTER TABLE {STAGING_TABLE} RENAME TO trivias")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        conn.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        raise
+    finally:
+        conn.close()
+    logging.info(f"Trivia import finished: {count} rows in {time.monotonic() - start:.1f}s")
+    return count
@@ -0,0 +1,94 @@
+import random
+import threading
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix(x):
+    "splitmix64 finalizer, a cheap deterministic round function"
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & _MASK64
+    return x ^ (x >> 31)
+
+
+def _permute(position, modulus, seed):
+    "Bijection of [0, modulus): a keyed Feistel network on the next even power of two, cycle-walked into range"
+    half_bits = max(1, (modulus - 1).bit_length() + 1) // 2
+    half_mask = (1 << half_bits) - 1
+    x = position
+    while True:
+        left, right = x >> half_bits, x & half_mask
+        for round_nr in range(4):
+            left, right = right, left ^ (_mix(seed + round_nr * 0x9E3779B97F4A7C15 + right) & half_mask)
+        x = (left << half_bits) | right
+        if x < modulus:
+            return x
+
+
+class TriviaSampler:
+    """Walks the trivias ids in a persisted shuffled order, so no question repeats until all of them were played.
+
+    The order is a keyed permutation of the ids, so the cursor state is three integers
+    no matter how large the table grows."""
+
+    def __init__(self, adb):
+        self.adb = adb
+        self.state = None
+        self._lock = threading.Lock()
+
+    async def create_tables(self):
+        await self.adb.run(self._create_tables)
+
+    async def sample(self, n):
+        "Returns up to `n` trivias rows, none of them played since the current cycle started"
+        return await self.adb.run(self._sample, n)
+
+    def _create_tables(self, conn):
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS trivia_sampler (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            modulus INTEGER NOT NULL,
+            seed INTEGER NOT NULL,
+            position INTEGER NOT NULL
+        );
+        ''')
+        row = conn.execute("SELECT modulus, seed, position FROM trivia_sampler WHERE id = 1").fetchone()
+        self.state = tuple(row) if row else None
+
+    def _sample(self, conn, n):
+        with self._lock:
+            rows = []
+            # ids freed by deleted rows are skipped, so stop after a bounded number of misses
+            for _ in range(4):
+                missing = n - len(rows)
+                if missing <= 0:
+                    break
+                ids = self._next_ids(conn, missing)
+                if not ids:
+                    break
+                placeholders = ", ".join("?" * len(ids))
+                found = {r["id"]: dict(r) for r in conn.execute(f"SELECT * FROM trivias WHERE id IN ({placeholders})", ids)}
+                rows += [found[i] for i in ids if i in found]
+            if self.state:
+                conn.execute("INSERT OR REPLACE INTO trivia_sampler (id, modulus, seed, position) VALUES (1, ?, ?, ?)", self.state)
+            return rows
+
+    def _next_ids(self, conn, n):
+        ids = []
+        while len(ids) < n:
+            if self.state is None or self.state[2] >= self.state[0]:
+                if not self._new_cycle(conn):
+                    break
+            modulus, seed, position = self.state
+            end = min(modulus, position + n - len(ids))
+            ids += [_permute(p, modulus, seed) + 1 for p in range(position, end)]
+            self.state = (modulus, seed, end)
+        return ids
+
+    def _new_cycle(self, conn):
+        # the cycle covers the ids present when it starts, rows added later join the next one
+        max_id = conn.execute("SELECT max(id) FROM trivias").fetchone()[0]
+        if not max_id:
+            return False
+        self.state = (max_id, random.getrandbits(63), 0)
+        return True